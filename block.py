@@ -22,7 +22,7 @@ Misha Schwartz, and Jaisie Sin
 This file contains the Block class, the main data structure used in the game.
 """
 from __future__ import annotations
-from typing import Optional, Tuple, List
+from typing import Any, Callable, Dict, Optional, Tuple, List, Union
 import random
 import math
 
@@ -47,6 +47,168 @@ def generate_board(max_depth: int, size: int) -> Block:
     return board
 
 
+# The code of a subdivided block in the bytes of a serialized board.
+_SUBDIVIDED = 255
+
+# A board in the form returned by serialize_board: the position, size, level
+# and max_depth of the board, the colours of its leaves, and one byte per block.
+SerializedBoard = Tuple[Tuple[int, int], int, int, int,
+                        List[Tuple[int, int, int]], bytes]
+
+# The children of every leaf. Most of the blocks of a board are leaves, so they
+# share this tuple instead of each having an empty list.
+_NO_CHILDREN = ()
+
+
+def serialize_board(board: Block) -> SerializedBoard:
+    """Return a compact representation of <board> that can be sent to another
+    process, and turned back into a Block by deserialize_board.
+
+    The blocks of <board> are stored in preorder, one byte each: either the
+    index of the block's colour in the returned list of colours, or a code
+    meaning that the block is subdivided.
+
+    >>> board = Block((0, 0), 750, COLOUR_LIST[0], 0, 1)
+    >>> serialize_board(board)
+    ((0, 0), 750, 0, 1, [(1, 128, 181)], b'\\x00')
+    """
+    colours = []
+    indices = {}
+    codes = bytearray()
+    stack = [board]
+    while stack:
+        block = stack.pop()
+        if block.children:
+            codes.append(_SUBDIVIDED)
+            stack.extend(reversed(block.children))
+        else:
+            if block.colour not in indices:
+                indices[block.colour] = len(colours)
+                colours.append(block.colour)
+            codes.append(indices[block.colour])
+
+    return board.position, board.size, board.level, board.max_depth, \
+        colours, bytes(codes)
+
+
+def deserialize_board(data: SerializedBoard) -> Block:
+    """Return a new board that is equivalent to the board that <data> was made
+    from by serialize_board.
+    """
+    position, size, level, max_depth, colours, codes = data
+    return _deserialize_block(iter(codes), colours, position, size, level,
+                              max_depth)
+
+
+def _deserialize_block(codes: Any, colours: List[Tuple[int, int, int]],
+                       position: Tuple[int, int], size: int, level: int,
+                       max_depth: int) -> Block:
+    """Return the Block whose preorder codes come next in the iterator
+    <codes>, with the given <position>, <size>, <level> and <max_depth>.
+    """
+    code = next(codes)
+    if code != _SUBDIVIDED:
+        return Block(position, size, colours[code], level, max_depth)
+
+    block = Block(position, size, None, level, max_depth)
+    positions = block._children_positions()
+    child_size = block._child_size()
+    block.children = [_deserialize_block(codes, colours, positions[i],
+                                         child_size, level + 1, max_depth)
+                      for i in range(4)]
+    return block
+
+
+class _Children(list):
+    """The list of children of a Block.
+
+    Any change made through the methods of this list is reported to the Block
+    that owns it, which then adopts the new children and resets its cached
+    values, just as if its <children> attribute had been assigned. The owner
+    is set right after the list is made. Once the
+    owner's <children> is assigned a new list, this list is no longer its
+    children, and changes to it are no longer reported.
+    """
+    __slots__ = ('_owner',)
+
+    # === Private Attributes ===
+    # _owner:
+    #   The Block whose children these are, or None if this list is no longer
+    #   the children of any Block.
+    _owner: Optional[Block]
+
+    def __reduce__(self) -> Tuple[Any, Tuple[List[Block]], Any]:
+        """Return how to rebuild this list, for copy and pickle.
+
+        The default for a list would append the children one at a time,
+        reporting each of them to an owner that has not been restored yet.
+        """
+        return _Children, (list(self),), (None, {'_owner': self._owner})
+
+    def reorder(self, order: List[int]) -> None:
+        """Put the child at index order[i] at index i, for each i, without
+        reporting a change to the owner.
+        """
+        list.__setitem__(self, slice(None), [self[i] for i in order])
+
+    def _report(self) -> None:
+        """Report a change to this list to its owner, if it has one.
+        """
+        if self._owner is not None:
+            self._owner._adopt(self)
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        list.__setitem__(self, index, value)
+        self._report()
+
+    def __delitem__(self, index: Any) -> None:
+        list.__delitem__(self, index)
+        self._report()
+
+    def __iadd__(self, children: Any) -> _Children:
+        list.extend(self, children)
+        self._report()
+        return self
+
+    def __imul__(self, n: int) -> _Children:
+        list.__imul__(self, n)
+        self._report()
+        return self
+
+    def append(self, child: Block) -> None:
+        list.append(self, child)
+        self._report()
+
+    def extend(self, children: Any) -> None:
+        list.extend(self, children)
+        self._report()
+
+    def insert(self, index: int, child: Block) -> None:
+        list.insert(self, index, child)
+        self._report()
+
+    def pop(self, index: int = -1) -> Block:
+        child = list.pop(self, index)
+        self._report()
+        return child
+
+    def remove(self, child: Block) -> None:
+        list.remove(self, child)
+        self._report()
+
+    def clear(self) -> None:
+        list.clear(self)
+        self._report()
+
+    def sort(self, *args: Any, **kwargs: Any) -> None:
+        list.sort(self, *args, **kwargs)
+        self._report()
+
+    def reverse(self) -> None:
+        list.reverse(self)
+        self._report()
+
+
 class Block:
     """A square Block in the Blocky game, represented as a tree.
 
@@ -92,12 +254,53 @@ class Block:
         - its colour is not None.
     - level <= max_depth
     """
-    position: Tuple[int, int]
+    # Boards are copied once per candidate move by the AI players, so Blocks
+    # have fixed slots instead of a per-instance __dict__.
+    __slots__ = ('_position', 'size', '_colour', 'level', 'max_depth',
+                 '_children', '_stale', '_rotation', '_parent', '_hash',
+                 '_cache')
+
+    # === Private Attributes ===
+    # _position:
+    #   The value of <position>.
+    # _colour:
+    #   The value of <colour>.
+    # _children:
+    #   The value of <children>, or _NO_CHILDREN if this Block is a leaf.
+    #   Changes made to the list in place are reported to this Block, like an
+    #   assignment to <children>.
+    # _stale:
+    #   True iff the positions of the children of this Block may not yet be
+    #   consistent with the position of this Block. Moves only set this flag,
+    #   and the positions are brought up to date one level at a time, the
+    #   next time that <children> is read.
+    # _rotation:
+    #   The number of clockwise quarter turns that have been made to this
+    #   Block but not yet to its children, from 0 to 3. Like positions, these
+    #   are passed down one level at a time, the next time that <children> is
+    #   read, so a rotate is O(1) no matter how big this Block is.
+    # _parent:
+    #   The Block that this Block is a child of, or None if it is the root of
+    #   its board. Before a Block is changed, the pending rotations and
+    #   positions of all its ancestors are passed down to it.
+    # _hash:
+    #   The value of subtree_hash(), or None if it must be recomputed. When a
+    #   Block is changed, this is reset for the Block and its ancestors only.
+    # _cache:
+    #   The values computed from this Block by cached(), by key, or None if
+    #   there are none. This is reset whenever <_hash> is, and also when this
+    #   Block is turned by a rotation of its parent.
+    _position: Tuple[int, int]
     size: int
-    colour: Optional[Tuple[int, int, int]]
+    _colour: Optional[Tuple[int, int, int]]
     level: int
     max_depth: int
-    children: List[Block]
+    _children: Union[_Children, Tuple[()]]
+    _stale: bool
+    _rotation: int
+    _parent: Optional[Block]
+    _hash: Optional[int]
+    _cache: Optional[Dict[Any, Any]]
 
     def __init__(self, position: Tuple[int, int], size: int,
                  colour: Optional[Tuple[int, int, int]], level: int,
@@ -111,12 +314,259 @@ class Block:
             - level >= 0
             - max_depth >= level
         """
-        self.position = position
+        self._position = position
         self.size = size
-        self.colour = colour
+        self._colour = colour
         self.level = level
         self.max_depth = max_depth
-        self.children = []
+        self._children = _NO_CHILDREN
+        self._stale = False
+        self._rotation = 0
+        self._parent = None
+        self._hash = None
+        self._cache = None
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        """The (x, y) coordinates of the upper left corner of this Block.
+
+        Reading this attribute first passes the pending moves of the
+        ancestors of this Block down to it (see _settle_ancestors), so it
+        takes O(depth) time.
+        """
+        if self._parent is not None:
+            self._settle_ancestors()
+        return self._position
+
+    @position.setter
+    def position(self, position: Tuple[int, int]) -> None:
+        self._position = position
+        self._stale = True
+
+    @property
+    def colour(self) -> Optional[Tuple[int, int, int]]:
+        """The colour of this Block if it is not subdivided, or None.
+        """
+        return self._colour
+
+    @colour.setter
+    def colour(self, colour: Optional[Tuple[int, int, int]]) -> None:
+        self._colour = colour
+        self._changed()
+
+    @property
+    def children(self) -> List[Block]:
+        """The blocks into which this block is subdivided.
+
+        Reading this attribute first applies any rotation of this Block to
+        its children, and moves the children to the positions that are
+        consistent with this Block's position.
+
+        A leaf has no list of its own, so each read returns a new empty list.
+        If blocks are added to that list, it becomes this Block's children.
+
+        Like <position>, reading this attribute first passes the pending moves
+        of the ancestors of this Block down to it, so that a Block that was
+        read before one of its ancestors moved has the same children as one
+        read after.
+        """
+        if self._parent is not None:
+            self._settle_ancestors()
+        if self._rotation or self._stale:
+            self._settle()
+        if self._children:
+            return self._children
+        children = _Children()
+        children._owner = self
+        return children
+
+    @children.setter
+    def children(self, children: List[Block]) -> None:
+        if self._children is not _NO_CHILDREN:
+            self._children._owner = None
+        if children:
+            self._children = _Children(children)
+            self._children._owner = self
+        else:
+            self._children = _NO_CHILDREN
+        self._rotation = 0
+        self._children_changed()
+
+    def _adopt(self, children: _Children) -> None:
+        """Record that <children>, a list of the children of this Block, has
+        been changed in place.
+
+        If <children> was read from this Block while it was a leaf, it becomes
+        this Block's list of children.
+        """
+        if children is not self._children:
+            if self._children is not _NO_CHILDREN:
+                self._children._owner = None
+            self._children = children
+        self._children_changed()
+
+    def _children_changed(self) -> None:
+        """Record that the list of children of this Block has been changed:
+        the children are adopted by this Block, and moved to their positions
+        the next time that they are read.
+        """
+        for child in self._children:
+            child._parent = self
+        self._stale = True
+        self._changed()
+
+    def _changed(self) -> None:
+        """Record that this Block and its descendants have changed, so any
+        value cached on this Block or its ancestors must be recomputed.
+        """
+        block = self
+        while block is not None:
+            block._hash = None
+            block._cache = None
+            block = block._parent
+
+    def subtree_hash(self) -> int:
+        """Return a hash of the structure and colours of this Block and its
+        descendants.
+
+        Blocks with the same children and colours in the same order have the
+        same hash, no matter their positions. The hash is cached, and a move
+        only makes it be recomputed along the path from the changed Block up
+        to the root.
+        """
+        self._settle_ancestors()
+        return self._subtree_hash()
+
+    def _subtree_hash(self) -> int:
+        """Return subtree_hash(), given that the ancestors of this Block are
+        settled.
+        """
+        if self._hash is None:
+            children = self._settled_children()
+            if children:
+                self._hash = hash(tuple(child._subtree_hash()
+                                        for child in children))
+            else:
+                self._hash = hash(self._colour)
+        return self._hash
+
+    def cached(self, key: Any, compute: Callable[[Block], Any]) -> Any:
+        """Return compute(self), the value identified by <key>, computing it
+        only if it has not been computed since this Block last changed.
+
+        <compute> must depend only on the structure and colours of this Block
+        and its descendants, and must not change the value it returns. Like
+        subtree_hash, a move only makes the values be recomputed along the
+        path from the changed Block up to the root, and inside a rotated
+        Block.
+
+        Values are only stored on Blocks that have children. Leaves make up
+        most of a board, and their values take O(1) time to compute, so
+        storing them would only add memory.
+        """
+        if not self._children:
+            return compute(self)
+        self._settle_ancestors()
+        if self._cache is None:
+            self._cache = {}
+        elif key in self._cache:
+            return self._cache[key]
+        value = compute(self)
+        self._cache[key] = value
+        return value
+
+    def colour_counts(self) -> Dict[Tuple[int, int, int], int]:
+        """Return a dictionary mapping each colour in this Block to the number
+        of unit cells of that colour, where a unit cell is a block at a level
+        of max_depth.
+
+        The counts are cached on each Block (see cached), so this takes O(1)
+        time for a Block that has not changed since its last call.
+        """
+        return dict(self.cached('colour_counts', Block._count_colours))
+
+    def _count_colours(self) -> Dict[Tuple[int, int, int], int]:
+        """Return colour_counts(), from the counts of the children of this
+        Block.
+        """
+        if not self.children:
+            return {self._colour: 4 ** (self.max_depth - self.level)}
+
+        counts = {}
+        for child in self._children:
+            for colour, count in child.cached('colour_counts',
+                                              Block._count_colours).items():
+                counts[colour] = counts.get(colour, 0) + count
+        return counts
+
+    def _settle(self) -> None:
+        """Apply the pending rotation of this Block to its children, and move
+        them to the positions that are consistent with this Block's position.
+        """
+        if self._rotation:
+            self._rotate_children()
+        if self._stale:
+            if len(self._children) == 4:
+                self._place_children()
+            else:
+                self._stale = False
+
+    def _settle_ancestors(self) -> None:
+        """Pass the pending rotations and positions of every ancestor of this
+        Block down to this Block, starting from the root of its board.
+
+        This is done before a Block is changed, since a change to a Block that
+        is still waiting for the rotation of one of its ancestors would be
+        applied in the wrong order, and before anything that depends on the
+        order of its children is read. Only the ancestors from the highest one
+        with anything pending down to this Block are settled.
+        """
+        top = None
+        parent = self._parent
+        while parent is not None:
+            if parent._stale or parent._rotation:
+                top = parent
+            parent = parent._parent
+        if top is None:
+            # The common case: nothing is pending, and nothing is allocated.
+            return
+
+        path = []
+        parent = self._parent
+        while parent is not top:
+            path.append(parent)
+            parent = parent._parent
+        top._settle()
+        for ancestor in reversed(path):
+            ancestor._settle()
+
+    def _settled_children(self) -> Union[List[Block], Tuple[()]]:
+        """Return the children of this Block, settling this Block but not its
+        ancestors.
+
+        This is for walks down a board from a Block whose ancestors are
+        already settled, where each Block is settled by the time its children
+        are visited, so that the walk takes O(n) time instead of O(n * depth).
+        """
+        if self._rotation or self._stale:
+            self._settle()
+        return self._children
+
+    def _rotate_children(self) -> None:
+        """Apply the pending rotation of this Block to its children.
+
+        The children are reordered, and the rotation is added to each child's
+        own pending rotation, to be applied to the grandchildren later.
+        """
+        turns = self._rotation
+        self._children.reorder([(i + turns) % 4 for i in range(4)])
+        for child in self._children:
+            if child._children:
+                child._rotation = (child._rotation + turns) % 4
+                child._hash = None
+                child._cache = None
+        self._rotation = 0
+        self._stale = True
 
     def __str__(self) -> str:
         """Return this Block in a string format.
@@ -144,21 +594,38 @@ class Block:
         """Return True iff this Block and all its descendents are equivalent to
         the <other> Block and all its descendents.
         """
-        if len(self.children) == 0 and len(other.children) == 0:
+        if self.subtree_hash() != other.subtree_hash():
+            # The colours or structure differ somewhere below.
+            return False
+        else:
+            # subtree_hash has settled the ancestors of both blocks.
+            return self._same_as(other)
+
+    def _same_as(self, other: Block) -> bool:
+        """Return True iff this Block and all its descendents are equivalent to
+        the <other> Block and all its descendents, given that the ancestors of
+        both blocks are settled.
+        """
+        children = self._settled_children()
+        other_children = other._settled_children()
+        if len(children) == 0 and len(other_children) == 0:
             # Both self and other are leaves.
-            return self.position == other.position and \
+            return self._position == other._position and \
                    self.size == other.size and \
-                   self.colour == other.colour and \
+                   self._colour == other._colour and \
                    self.level == other.level and \
                    self.max_depth == other.max_depth
-        elif len(self.children) != len(other.children):
+        elif len(children) != len(other_children):
             # One of self or other is a leaf while the other is not.
             return False
         else:
             # Both self and other have four children.
             for i in range(4):
-                # The != operator also uses the __eq__ special method.
-                if self.children[i] != other.children[i]:
+                if children[i]._hash is not None and \
+                        other_children[i]._hash is not None and \
+                        children[i]._hash != other_children[i]._hash:
+                    return False
+                if not children[i]._same_as(other_children[i]):
                     return False
 
             return True
@@ -180,18 +647,23 @@ class Block:
 
         return [(x + size, y), (x, y), (x, y + size), (x + size, y + size)]
 
-    def _update_children_positions(self, position: Tuple[int, int]) -> None:
-        """Set the position of this Block to <position> and update all its
-        descendants to have positions consistent with this Block's.
+    def _place_children(self) -> None:
+        """Move the children of this Block to the positions that are
+        consistent with this Block's position.
 
-        <position> is the (x, y) coordinates of the upper-left corner of this
-        Block.
+        Only the children themselves are moved. A child that has moved is
+        marked as stale, so that its own children are moved when they are
+        next read.
         """
-        self.position = position
-        child_postions = self._children_positions()
-        if len(self.children) == 4:
-            for i in range(4):
-                self.children[i]._update_children_positions(child_postions[i])
+        positions = self._children_positions()
+        for i in range(4):
+            child = self._children[i]
+            child._parent = self
+            if child._position != positions[i]:
+                child._position = positions[i]
+                if child._children:
+                    child._stale = True
+        self._stale = False
 
     def smashable(self) -> bool:
         """Return True iff this block can be smashed.
@@ -213,19 +685,22 @@ class Block:
         if not self.smashable():
             return False
         else:
+            self._settle_ancestors()
             r = random.random()
             level = self.level
             child_size = self._child_size()
             child_positions = self._children_positions()
             if r < math.exp(-0.25 * level):
                 self.colour = None
+                children = []
                 for i in range(4):
                     colour = COLOUR_LIST[random.randint(0,
                                                         len(COLOUR_LIST) - 1)]
                     child = Block(child_positions[i], child_size, colour,
                                   level + 1, self.max_depth)
                     child.smash()
-                    self.children.append(child)
+                    children.append(child)
+                self.children = children
             else:
                 self.colour = COLOUR_LIST[random.randint(0,
                                                          len(COLOUR_LIST) - 1)]
@@ -242,25 +717,19 @@ class Block:
 
         Precondition: <direction> is either 0 or 1
         """
-        if not self.children:
+        if not self._children:
             return False
         else:
+            self._settle_ancestors()
             if direction == 0:
-                up_right = self.children[0]
-                down_right = self.children[3]
-                self.children[0] = self.children[1]
-                self.children[3] = self.children[2]
-                self.children[1] = up_right
-                self.children[2] = down_right
+                # Upper-right with upper-left, lower-left with lower-right.
+                self.children.reorder([1, 0, 3, 2])
             else:
-                up_right = self.children[0]
-                up_left = self.children[1]
-                self.children[0] = self.children[3]
-                self.children[1] = self.children[2]
-                self.children[3] = up_right
-                self.children[2] = up_left
+                # Upper-right with lower-right, upper-left with lower-left.
+                self.children.reorder([3, 2, 1, 0])
 
-            self._update_children_positions(self.position)
+            self._stale = True
+            self._changed()
 
         return True
 
@@ -274,27 +743,12 @@ class Block:
 
         Precondition: <direction> is either 1 or 3.
         """
-        if not self.children:
+        if not self._children:
             return False
         else:
-            if direction == 1:
-                up_right = self.children[0]
-                self.children[0] = self.children[1]
-                self.children[1] = self.children[2]
-                self.children[2] = self.children[3]
-                self.children[3] = up_right
-            else:
-                up_right = self.children[0]
-                self.children[0] = self.children[3]
-                self.children[3] = self.children[2]
-                self.children[2] = self.children[1]
-                self.children[1] = up_right
-
-            self._update_children_positions(self.position)
-
-            for child in self.children:
-                child.rotate(direction)
-
+            # Clockwise is one quarter turn, and counter-clockwise is three.
+            self._rotation = (self._rotation + direction) % 4
+            self._changed()
             return True
 
     def paint(self, colour: Tuple[int, int, int]) -> bool:
@@ -322,37 +776,98 @@ class Block:
 
         Return True iff this Block was turned into a leaf node.
         """
-        if len(self.children) == 4 and self.level == self.max_depth - 1:
-            d = {colour1: 0 for colour1 in COLOUR_LIST}
-            for child in self.children:
-                d[child.colour] += 1
+        if len(self._children) == 4 and self.level == self.max_depth - 1:
+            self._settle_ancestors()
+            counts = self.colour_counts()
+            most = max(counts.values())
+            majority = [colour for colour in counts if counts[colour] == most]
+            if len(majority) == 1:
+                self.children = []
+                self.colour = majority[0]
+                return True
 
-            values = list(d.values())
+        return False
 
-            for colour in d:
-                if d[colour] == max(values) and values.count(d[colour]) == 1:
-                    self.children = []
-                    self.colour = colour
-                    return True
+    def apply_move(self, action: Tuple[str, Optional[int]],
+                   colour: Tuple[int, int, int]) -> Optional[Tuple[str, Any]]:
+        """Perform <action> on this Block in place, painting with <colour> if
+        <action> is a paint.
 
-        return False
+        <action> is one of the actions in actions.py other than PASS, i.e. a
+        tuple of the name of the move ('rotate', 'swap', 'smash', 'paint' or
+        'combine') and its direction, if any.
+
+        Return None if the action was not performed. Otherwise, return an
+        undo token which undo_move can use to restore this Block to exactly
+        the state that it was in before the action.
+        """
+        name, direction = action
+        if name == 'rotate':
+            if self.rotate(direction):
+                return name, 4 - direction
+        elif name == 'swap':
+            if self.swap(direction):
+                return name, direction
+        elif name == 'smash':
+            old_colour = self.colour
+            if self.smash():
+                return name, old_colour
+        elif name == 'paint':
+            old_colour = self.colour
+            if self.paint(colour):
+                return name, old_colour
+        elif name == 'combine':
+            old_children = self.children
+            if self.combine():
+                return name, old_children
+        return None
+
+    def undo_move(self, token: Tuple[str, Any]) -> None:
+        """Undo the action that returned <token> from apply_move.
+
+        Precondition: <token> was returned by apply_move on this Block, and
+        every later action performed on this Block or its descendants has
+        already been undone.
+        """
+        self._settle_ancestors()
+        name, data = token
+        if name == 'rotate':
+            self.rotate(data)
+        elif name == 'swap':
+            self.swap(data)
+        elif name in ('smash', 'paint'):
+            self.children = []
+            self.colour = data
+        else:
+            self.children = data
+            self.colour = None
 
     def create_copy(self) -> Block:
         """Return a new Block that is a deep copy of this Block.
 
         Remember that a deep copy has new blocks (not aliases) at every level.
         """
-        if not self.children:
-            return Block(self.position, self.size, self.colour, self.level,
-                         self.max_depth)
-        else:
-            children = []
-            for child in self.children:
-                children.append(child.create_copy())
-            b = Block(self.position, self.size, self.colour, self.level,
-                      self.max_depth)
-            b.children = children
-            return b
+        self._settle_ancestors()
+        return self._copy()
+
+    def _copy(self, parent: Optional[Block] = None) -> Block:
+        """Return create_copy(), as a child of <parent>, given that the
+        ancestors of this Block are settled.
+
+        The copies are linked up directly rather than through <children>, as
+        they are already at their positions, and their hashes are known.
+        """
+        b = Block(self._position, self.size, self._colour, self.level,
+                  self.max_depth)
+        b._parent = parent
+        if self._rotation or self._stale:
+            self._settle()
+        if self._children:
+            b._children = _Children([child._copy(b)
+                                     for child in self._children])
+            b._children._owner = b
+            b._hash = self._hash
+        return b
 
 
 if __name__ == '__main__':
@@ -23,15 +23,17 @@ This file contains the different game states for the Blocky game.
 """
 
 from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 import pygame
 
 from actions import ACTION_MESSAGE, ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE,\
     SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
 from block import Block
-from player import Player
+from goal import ScoreCache
+from player import HumanPlayer, Player, _get_block
 from renderer import Renderer
-from settings import ANIMATION_DURATION
+from settings import ANIMATION_DURATION, SCORE_CACHE_CAPACITY
 
 
 def _block_to_squares(board: Block) -> List[Tuple[Tuple[int, int, int],
@@ -64,6 +66,8 @@ class GameData:
     === Public Attributes ===
     max_turns:
         The maximum number of turns for the game.
+    turn:
+        The current turn. A turn is over once every player has moved.
     board:
         The Blocky board on which this game will be played.
     players:
@@ -74,31 +78,41 @@ class GameData:
         The number of combines done by each player.
     paints:
         The number of paints done by each player.
+    score_cache:
+        The goal scores of recent boards, shared by every score calculation
+        in this game, including those of the players that look the current
+        board up in it (see SmartPlayer.join_game).
 
     === Representation Invariants ===
     - len(players) >= 1
     """
     max_turns: int
+    turn: int
     board: Block
     players: List[Player]
     smashes: Dict[int, int]
     combines: Dict[int, int]
     paints: Dict[int, int]
+    score_cache: ScoreCache
 
-    def __init__(self, board: Block, players: List[Player]) -> None:
+    def __init__(self, board: Block, players: List[Player],
+                 cache_capacity: int = SCORE_CACHE_CAPACITY) -> None:
         """Initialize the game data, saving a reference to <board> and
-        <players>.
+        <players>, with a score cache that holds <cache_capacity> scores.
 
         Precondition:
             - len(players) >= 1
+            - cache_capacity >= 1
         """
         self.max_turns = 0
+        self.turn = 0
         self.board = board
         self.players = players
 
         self.smashes = {}
         self.combines = {}
         self.paints = {}
+        self.score_cache = ScoreCache(cache_capacity)
 
         # Start off all counts at 0
         for player in players:
@@ -106,18 +120,26 @@ class GameData:
             self.combines[player.id] = 0
             self.paints[player.id] = 0
 
+        for player in players:
+            player.join_game(self)
+
     def calculate_score(self, player_id: int) -> Tuple[int, int]:
         """Return a tuple containing first the <player_id>'s score based on
         their goal in the game and second the deductions from their score based
         on the actions they've taken.
         """
-        goal_score = self.players[player_id].goal.score(self.board)
+        goal_score = self.score_cache.score(self.players[player_id].goal,
+                                            self.board)
 
-        penalty = self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
-                  self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
-                  self.paints[player_id] * ACTION_PENALTY[PAINT]
+        return goal_score, self.calculate_penalty(player_id)
 
-        return goal_score, penalty
+    def calculate_penalty(self, player_id: int) -> int:
+        """Return the deductions from <player_id>'s score based on the actions
+        they've taken.
+        """
+        return self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
+            self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
+            self.paints[player_id] * ACTION_PENALTY[PAINT]
 
 
 class GameState:
@@ -143,32 +165,50 @@ class GameState:
         """
         raise NotImplementedError
 
+    def close(self) -> None:
+        """Release the resources held by this GameState, once the game is over
+        or has been quit. By default, there are none.
+        """
+        return
+
 
 class MainState(GameState):
     """A GameState that manages the moves made by different players in Blocky.
 
     === Private Attributes ===
-    _turn:
-      The current turn.
     _data:
       A reference to the shared GameData.
     _current_player_index:
       The index of the current player in GameData.players.
     _current_score:
       The score of the current player, including penalties.
+    _thinker:
+      The thread in which players other than a HumanPlayer choose their
+      moves, so that the game keeps rendering and handling events meanwhile.
+    _thinking:
+      The move that the current player is choosing in <_thinker>, or None if
+      it is not choosing one.
+    _waiting:
+      True iff the last move chosen in <_thinker> was None, because the
+      current player is waiting for an event, and no event has been passed
+      to the player since. The player is not asked again until there is one.
     """
 
-    _turn: int
     _data: GameData
     _current_player_index: int
     _current_score: int
+    _thinker: ThreadPoolExecutor
+    _thinking: Optional[Future]
+    _waiting: bool
 
     def __init__(self, data: GameData) -> None:
         """Initialize this GameState.
         """
-        self._turn = 0
         self._data = data
         self._current_player_index = 0
+        self._thinker = ThreadPoolExecutor(1)
+        self._thinking = None
+        self._waiting = False
 
         score, penalty = self._data.calculate_score(self._current_player().id)
         self._current_score = score - penalty
@@ -188,7 +228,7 @@ class MainState(GameState):
         self._current_score = score - penalty
 
         if self._current_player_index == 0:
-            self._turn += 1
+            self._data.turn += 1
 
     def _do_move(self, move: Tuple[str, Optional[int], Block]) -> bool:
         """Attempt to do the player's requested move.
@@ -221,15 +261,47 @@ class MainState(GameState):
 
         return move_successful
 
+    def _generate_move(self) -> Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move that the current player would like to perform, or
+        None if the player has not chosen one yet.
+
+        A HumanPlayer is asked directly. Any other player chooses its move in
+        <_thinker>, on a copy of the board that is made here, since reading a
+        Block can update it. Until that move is ready, return None; then
+        return the move with the matching block of the real board.
+        """
+        player = self._current_player()
+        if isinstance(player, HumanPlayer):
+            return player.generate_move(self._data.board)
+
+        if self._thinking is None:
+            if self._waiting:
+                return None
+            self._thinking = self._thinker.submit(
+                player.generate_move, self._data.board.create_copy())
+            return None
+        elif not self._thinking.done():
+            return None
+
+        move = self._thinking.result()
+        self._thinking = None
+        if move is None:
+            self._waiting = True
+            return None
+        return move[0], move[1], _get_block(self._data.board,
+                                            move[2].position, move[2].level)
+
     def process_event(self, event: pygame.event.Event) -> None:
         self._current_player().process_event(event)
+        self._waiting = False
 
     def update(self) -> GameState:
-        if self._turn >= self._data.max_turns:
+        if self._data.turn >= self._data.max_turns:
+            self.close()
             return GameOverState(self._data)
 
         # Ask the player to make a move
-        move = self._current_player().generate_move(self._data.board)
+        move = self._generate_move()
 
         if move is None:
             # No move was made, stay in the current state
@@ -256,10 +328,20 @@ class MainState(GameState):
             renderer.highlight_block(b.position, b.size)
 
         p = self._current_player()
-        status = f'Turn {self._turn} | Player {p.id} | ' \
+        status = f'Turn {self._data.turn} | Player {p.id} | ' \
                  f'Score {self._current_score} | {p.goal.description()}'
         renderer.draw_status(status)
 
+    def close(self) -> None:
+        """Stop <_thinker>, without waiting for a move that is still being
+        chosen, so that no thread is left running once the game is over, and
+        close every player.
+        """
+        self._thinker.shutdown(wait=False, cancel_futures=True)
+        self._thinking = None
+        for player in self._data.players:
+            player.close()
+
 
 class AnimateMoveState(GameState):
     """A GameState that animates a move made by a player before returning to its
@@ -325,6 +407,9 @@ class AnimateMoveState(GameState):
         status = f'Player {self._player_id} is {ACTION_MESSAGE[action]}'
         renderer.draw_status(status)
 
+    def close(self) -> None:
+        self._parent.close()
+
 
 class GameOverState(GameState):
     """A GameState that is displayed when the game is over.
@@ -379,7 +464,8 @@ if __name__ == '__main__':
         'allowed-io': ['run_game'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'pygame', '__future__',
-            'block', 'player', 'renderer', 'settings', 'actions'
+            'block', 'goal', 'player', 'renderer', 'settings', 'actions',
+            'concurrent.futures'
         ],
         'generated-members': 'pygame.*'
     })
@@ -25,7 +25,7 @@ Blocky game.
 At the bottom of the file, there are some function that you
 can call to try playing the game in several different configurations.
 """
-from typing import List
+from typing import List, Optional
 import pygame
 
 from block import generate_board
@@ -52,14 +52,19 @@ class Game:
     def __init__(self, max_depth: int,
                  num_human: int,
                  num_random: int,
-                 smart_players: List[int]) -> None:
+                 smart_players: List[int],
+                 time_limit: Optional[float] = None) -> None:
         """Initialize this game, as described in the Assignment 2 handout.
 
+        If <time_limit> is not None, the smart players spend at most about
+        <time_limit> seconds on each move (see create_players).
+
         Precondition:
             2 <= max_depth <= 5
         """
         board = generate_board(max_depth, BOARD_SIZE)
-        players = create_players(num_human, num_random, smart_players)
+        players = create_players(num_human, num_random, smart_players,
+                                 time_limit)
 
         self._renderer = Renderer(BOARD_SIZE)
         self._data = GameData(board, players)
@@ -77,6 +82,7 @@ class Game:
             # Process events
             for e in pygame.event.get():
                 if e.type == pygame.QUIT:
+                    self._state.close()
                     return
                 else:
                     self._state.process_event(e)
@@ -125,7 +131,8 @@ if __name__ == '__main__':
             'doctest', 'python_ta', 'random', 'typing', 'pygame', 'blocky',
             'block', 'goal', 'player', 'renderer', 'settings'
         ],
-        'generated-members': 'pygame.*'
+        'generated-members': 'pygame.*',
+        'max-args': 6
     })
 
     pygame.init()
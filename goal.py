@@ -23,10 +23,16 @@ This file contains the hierarchy of Goal classes.
 """
 from __future__ import annotations
 import random
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 from block import Block
 from settings import colour_name, COLOUR_LIST
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the raster helpers
+    np = None
+
 
 def generate_goals(num_goals: int) -> List[Goal]:
     """Return a randomly generated list of goals with length num_goals.
@@ -89,6 +95,317 @@ def _flatten(block: Block) -> List[List[Tuple[int, int, int]]]:
         return lst
 
 
+def largest_blobs(board: Block) -> Dict[Tuple[int, int, int], int]:
+    """Return a dictionary mapping each colour to the size of the largest blob
+    of that colour on <board>.
+
+    Every colour in COLOUR_LIST is a key, with a value of 0 if it does not
+    appear on <board>. Any other colour on <board> is included as well.
+
+    The board is flattened once, and its unit cells are labelled in a single
+    sweep with a union-find structure, so this is the same amount of work as
+    scoring one BlobGoal, rather than one per colour.
+    """
+    flattened = _flatten(board)
+    n = len(flattened)
+    parent = list(range(n * n))
+    size = [1] * (n * n)
+
+    def find(cell: int) -> int:
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    def union(cell1: int, cell2: int) -> None:
+        root1 = find(cell1)
+        root2 = find(cell2)
+        if root1 != root2:
+            if size[root1] < size[root2]:
+                root1, root2 = root2, root1
+            parent[root2] = root1
+            size[root1] += size[root2]
+
+    # Cell (i, j) is numbered i * n + j. Each cell only needs to be joined to
+    # its neighbours in the previous column and the previous row.
+    for i in range(n):
+        column = flattened[i]
+        for j in range(n):
+            if i > 0 and flattened[i - 1][j] == column[j]:
+                union((i - 1) * n + j, i * n + j)
+            if j > 0 and column[j - 1] == column[j]:
+                union(i * n + j - 1, i * n + j)
+
+    blobs = {colour: 0 for colour in COLOUR_LIST}
+    for i in range(n):
+        for j in range(n):
+            cell = i * n + j
+            if parent[cell] == cell:
+                colour = flattened[i][j]
+                blobs[colour] = max(blobs.get(colour, 0), size[cell])
+    return blobs
+
+
+def _flatten_indices(block: Block) -> np.ndarray:
+    """Return a two-dimensional NumPy array of uint8 representing <block> as
+    rows and columns of unit cells.
+
+    The array A has the same layout as the list returned by _flatten, but
+    A[i, j] is the index in COLOUR_LIST of the colour of the unit cell at
+    column i and row j, rather than the colour itself. It is filled with one
+    slice assignment per leaf, and takes one byte per unit cell.
+
+    Raise ImportError if numpy is not installed, and ValueError if <block>
+    contains a colour that is not in COLOUR_LIST.
+    """
+    if np is None:
+        raise ImportError('_flatten_indices requires numpy')
+    n = 2 ** (block.max_depth - block.level)
+    raster = np.empty((n, n), dtype=np.uint8)
+    _fill_indices(block, raster, 0, 0, n)
+    return raster
+
+
+def _fill_indices(block: Block, raster: np.ndarray, x: int, y: int,
+                  n: int) -> None:
+    """Fill the <n> by <n> square of <raster> whose upper left corner is at
+    column <x> and row <y> with the colour indices of <block>.
+    """
+    if len(block.children) == 0:
+        raster[x:x + n, y:y + n] = COLOUR_LIST.index(block.colour)
+    else:
+        half = n // 2
+        _fill_indices(block.children[0], raster, x + half, y, half)
+        _fill_indices(block.children[1], raster, x, y, half)
+        _fill_indices(block.children[2], raster, x, y + half, half)
+        _fill_indices(block.children[3], raster, x + half, y + half, half)
+
+
+def _label_raster(raster: np.ndarray) -> np.ndarray:
+    """Return an array of the same shape as <raster>, in which every cell holds
+    the label of the blob that it belongs to in <raster>.
+
+    Two cells have the same label iff they are connected by a path of
+    neighbouring cells of the same colour. Labels are computed with array
+    operations only: each round hooks the root of every blob onto the
+    smallest root of a neighbouring blob of the same colour, and then
+    follows parent pointers until every cell points at its root.
+    """
+    n = raster.shape[0]
+    cells = np.arange(n * n).reshape(n, n)
+    same_column = raster[:, :-1] == raster[:, 1:]
+    same_row = raster[:-1, :] == raster[1:, :]
+    first = np.concatenate((cells[:, :-1][same_column],
+                            cells[:-1, :][same_row]))
+    second = np.concatenate((cells[:, 1:][same_column],
+                             cells[1:, :][same_row]))
+
+    parent = np.arange(n * n)
+    while True:
+        root1 = parent[first]
+        root2 = parent[second]
+        low = np.minimum(root1, root2)
+        high = np.maximum(root1, root2)
+        changed = low != high
+        if not changed.any():
+            return parent.reshape(n, n)
+        np.minimum.at(parent, high[changed], low[changed])
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+
+# A run of unit cells along one side of a block: the first cell, one past the
+# last cell (both counted from the upper-left corner of the block), and the
+# label of the blob that the run belongs to.
+_Segment = Tuple[int, int, int]
+
+# The sides of a block that no blob touches, shared by all such summaries.
+_NO_SIDES = ((), (), (), ())
+
+# The keys of the blob summaries of each colour in Block.cached, shared by
+# all Blocks instead of being stored once per Block.
+_BLOB_KEYS = {}
+
+
+def _blob_summary(block: Block, colour: Tuple[int, int, int]) \
+        -> Tuple[Tuple[Tuple[_Segment, ...], ...], Tuple[int, ...], int]:
+    """Return a summary of the blobs of <colour> inside <block>.
+
+    The summary is a tuple (sides, sizes, closed) where:
+        - sides is a tuple of the top, bottom, left and right sides of
+          <block>, each a tuple of the runs of <colour> along that side in
+          order, labelled by the blob that they belong to,
+        - sizes[label] is the size of the blob with that label; every such
+          blob touches at least one side of <block>,
+        - closed is the size of the largest blob that does not touch any side
+          of <block>, which no block outside of <block> can ever extend.
+
+    Each leaf is treated as a single weighted node. A parent joins the
+    summaries of its four children by matching up the runs on either side of
+    the two seams between them, so no unit cell is ever visited.
+
+    Summaries are cached on each Block (see Block.cached), so after a move
+    only the blocks along the path to the moved block are summarized again.
+    """
+    key = _BLOB_KEYS.setdefault(colour, ('blobs', colour))
+    return block.cached(key, lambda b: _summarize_blobs(b, colour))
+
+
+def _summarize_blobs(block: Block, colour: Tuple[int, int, int]) \
+        -> Tuple[Tuple[Tuple[_Segment, ...], ...], Tuple[int, ...], int]:
+    """Return _blob_summary(block, colour), from the summaries of the children
+    of <block>.
+    """
+    n = 2 ** (block.max_depth - block.level)
+    if len(block.children) == 0:
+        if block.colour != colour:
+            return _NO_SIDES, (), 0
+        segment = ((0, n, 0),)
+        return (segment, segment, segment, segment), (n * n,), 0
+
+    half = n // 2
+    summaries = [_blob_summary(child, colour) for child in block.children]
+    parent = []
+    sizes = []
+    bases = []
+    closed = 0
+    for child_sides, child_sizes, child_closed in summaries:
+        bases.append(len(sizes))
+        parent.extend(range(len(sizes), len(sizes) + len(child_sizes)))
+        sizes.extend(child_sizes)
+        closed = max(closed, child_closed)
+
+    def find(label: int) -> int:
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def join(first: Tuple[_Segment, ...], first_base: int,
+             second: Tuple[_Segment, ...], second_base: int) -> None:
+        # Union every pair of overlapping runs from the two sides of a seam.
+        i = 0
+        j = 0
+        while i < len(first) and j < len(second):
+            start1, end1, label1 = first[i]
+            start2, end2, label2 = second[j]
+            if start1 < end2 and start2 < end1:
+                root1 = find(label1 + first_base)
+                root2 = find(label2 + second_base)
+                if root1 != root2:
+                    parent[root2] = root1
+                    sizes[root1] += sizes[root2]
+            if end1 < end2:
+                i += 1
+            else:
+                j += 1
+
+    up_right, up_left, down_left, down_right = [s[0] for s in summaries]
+    join(up_left[3], bases[1], up_right[2], bases[0])
+    join(down_left[3], bases[2], down_right[2], bases[3])
+    join(up_left[1], bases[1], down_left[0], bases[2])
+    join(up_right[1], bases[0], down_right[0], bases[3])
+
+    def side(first: Tuple[_Segment, ...], first_base: int,
+             second: Tuple[_Segment, ...], second_base: int) \
+            -> List[_Segment]:
+        # Concatenate two half sides, merging touching runs of the same blob.
+        result = []
+        for segments, base, offset in ((first, first_base, 0),
+                                       (second, second_base, half)):
+            for start, end, label in segments:
+                root = find(label + base)
+                if result and result[-1][1] == start + offset and \
+                        result[-1][2] == root:
+                    result[-1] = (result[-1][0], end + offset, root)
+                else:
+                    result.append((start + offset, end + offset, root))
+        return result
+
+    sides = (side(up_left[0], bases[1], up_right[0], bases[0]),
+             side(down_left[1], bases[2], down_right[1], bases[3]),
+             side(up_left[2], bases[1], down_left[2], bases[2]),
+             side(up_right[3], bases[0], down_right[3], bases[3]))
+
+    # Relabel the blobs that still touch a side, and retire the rest.
+    labels = {}
+    for segments in sides:
+        for _, _, root in segments:
+            if root not in labels:
+                labels[root] = len(labels)
+    for label in range(len(sizes)):
+        if parent[label] == label and label not in labels:
+            closed = max(closed, sizes[label])
+    if not labels:
+        return _NO_SIDES, (), closed
+    new_sizes = [0] * len(labels)
+    for root, label in labels.items():
+        new_sizes[label] = sizes[root]
+    new_sides = tuple(tuple((start, end, labels[root])
+                            for start, end, root in segments)
+                      for segments in sides)
+    return new_sides, tuple(new_sizes), closed
+
+
+# The indices of the children of a block that touch its top, bottom, left and
+# right sides, respectively.
+_SIDE_CHILDREN = ((0, 1), (2, 3), (1, 2), (0, 3))
+
+# The keys of the counts along each side in Block.cached.
+_SIDE_KEYS = (('side', 0), ('side', 1), ('side', 2), ('side', 3))
+
+
+def _side_counts(block: Block, side: int) -> Dict[Tuple[int, int, int], int]:
+    """Return a dictionary mapping each colour to the number of unit cells of
+    that colour along one side of <block>.
+
+    <side> is 0, 1, 2 or 3 for the top, bottom, left or right side of <block>,
+    respectively. Only the children that touch <side> are visited, and a leaf
+    contributes one cell per unit of its size. Like _blob_summary, the counts
+    are cached on each Block.
+    """
+    return block.cached(_SIDE_KEYS[side], lambda b: _count_side(b, side))
+
+
+def _count_side(block: Block, side: int) -> Dict[Tuple[int, int, int], int]:
+    """Return _side_counts(block, side), from the counts of the children of
+    <block>.
+    """
+    if len(block.children) == 0:
+        return {block.colour: 2 ** (block.max_depth - block.level)}
+
+    counts = {}
+    for i in _SIDE_CHILDREN[side]:
+        for colour, count in _side_counts(block.children[i], side).items():
+            counts[colour] = counts.get(colour, 0) + count
+    return counts
+
+
+def _sides_touched(board: Block, block: Block) -> List[int]:
+    """Return the sides of <board> that <block> lies along, numbered as in
+    _side_counts.
+
+    <block> is found by following its position down from <board>.
+
+    Precondition: <block> is <board> or one of its descendants.
+    """
+    sides = [0, 1, 2, 3]
+    x, y = block.position
+    current = board
+    while current is not block:
+        for i in range(4):
+            child = current.children[i]
+            if child.position[0] <= x < child.position[0] + child.size and \
+                    child.position[1] <= y < child.position[1] + child.size:
+                break
+        sides = [side for side in sides if i in _SIDE_CHILDREN[side]]
+        current = child
+    return sides
+
+
 class Goal:
     """A player goal in the game of Blocky.
 
@@ -113,6 +430,27 @@ class Goal:
         """
         raise NotImplementedError
 
+    def score_raster(self, raster: np.ndarray) -> int:
+        """Return the current score for this goal on the board represented by
+        <raster>, an array of colour indices as returned by _flatten_indices.
+
+        The score is always greater than or equal to 0, and is the same as
+        the score of the board that <raster> was made from.
+        """
+        raise NotImplementedError
+
+    def upper_bound(self, board: Block, block: Block) -> int:
+        """Return an upper bound on the score for this goal on <board> after
+        any one move is made to <block>.
+
+        Every move only changes the unit cells inside <block>, so the bound
+        assumes that they all become the target colour. It is much cheaper
+        than making the move and scoring the board.
+
+        Precondition: <block> is <board> or one of its descendants.
+        """
+        raise NotImplementedError
+
     def description(self) -> str:
         """Return a description of this goal.
         """
@@ -132,33 +470,34 @@ class PerimeterGoal(Goal):
     def score(self, board: Block) -> int:
         """ Returns the score of the <board> based on how many unit blocks of
         <colour> are on the perimeter. Corners count as double the points.
+
+        Only the blocks that touch the edge of <board> are visited (see
+        _side_counts). A corner cell lies on two sides, so it is counted
+        twice.
+        """
+        return sum(_side_counts(board, side).get(self.colour, 0)
+                   for side in range(4))
+
+    def score_raster(self, raster: np.ndarray) -> int:
+        """ Returns the score of the board represented by <raster>, by adding
+        up the cells of <colour> along each of its four edges. Corners lie on
+        two edges, so they count as double the points.
         """
-        flattened = _flatten(board)
-        s = 0
-
-        if board.max_depth == 0 and self.colour == board.colour:
-            return 4
-
-        for i in range(1, len(flattened) - 1):
-            if flattened[0][i] == self.colour:
-                s += 1
-            if flattened[-1][i] == self.colour:
-                s += 1
-            if flattened[i][0] == self.colour:
-                s += 1
-            if flattened[i][-1] == self.colour:
-                s += 1
-
-        if flattened[0][0] == self.colour:
-            s += 2
-        if flattened[0][-1] == self.colour:
-            s += 2
-        if flattened[-1][0] == self.colour:
-            s += 2
-        if flattened[-1][-1] == self.colour:
-            s += 2
-
-        return s
+        if self.colour not in COLOUR_LIST:
+            return 0
+        mask = raster == COLOUR_LIST.index(self.colour)
+        return int(mask[0, :].sum() + mask[-1, :].sum() + mask[:, 0].sum()
+                   + mask[:, -1].sum())
+
+    def upper_bound(self, board: Block, block: Block) -> int:
+        """ Returns the score of <board> with every perimeter cell inside
+        <block> changed to <colour>.
+        """
+        score = self.score(board)
+        for side in _sides_touched(board, block):
+            score += 2 ** (block.max_depth - block.level) - \
+                _side_counts(block, side).get(self.colour, 0)
+        return score
 
     def description(self) -> str:
         """ Returns a description describing the player's goal
@@ -184,22 +523,62 @@ class BlobGoal(Goal):
         """ Returns the score of <board> based on the largest blob of <colour>
         that exists on the board. Every unit square size of the colour
         belonging to the blob counts as 1 point.
+
+        The score is computed directly on the tree of Blocks (see
+        _blob_summary), so its cost depends on the number of leaves rather
+        than on the number of unit cells.
+        """
+        sides, sizes, closed = _blob_summary(board, self.colour)
+        return max((closed,) + sizes)
+
+    def score_raster(self, raster: np.ndarray) -> int:
+        """ Returns the score of the board represented by <raster>, based on
+        the largest blob of <colour> found by _label_raster.
+        """
+        if self.colour not in COLOUR_LIST:
+            return 0
+        mask = raster == COLOUR_LIST.index(self.colour)
+        if not mask.any():
+            return 0
+        return int(np.bincount(_label_raster(raster)[mask]).max())
+
+    def upper_bound(self, board: Block, block: Block) -> int:
+        """ Returns the larger of the score of <board> and the number of cells
+        of <colour> on <board> with every cell inside <block> changed to
+        <colour>.
+
+        A blob that lies outside <block> after a move was part of a blob
+        before the move, and a blob that reaches into <block> can at most
+        take every cell of <colour> outside of <block> and all of <block>.
+        """
+        outside = board.colour_counts().get(self.colour, 0) - \
+            block.colour_counts().get(self.colour, 0)
+        return max(self.score(board),
+                   outside + 4 ** (block.max_depth - block.level))
+
+    def _score_flattened(self, flattened: List[List[Tuple[int, int, int]]]) \
+            -> int:
+        """Return the size of the largest blob of this goal's colour in the
+        flattened board <flattened>.
+
+        Every unit cell is visited exactly once: a search is only started from
+        cells that no earlier blob has already claimed.
+
+        score does not use this. The tree scorer (see _blob_summary) already
+        handles boards up to a max_depth of 10 without visiting unit cells.
+        This flood fill, and _undiscovered_blob_size, are kept only as a
+        reference that the tests check score against.
         """
-        n = len(_flatten(board))
-        visits = []
+        n = len(flattened)
+        visited = [[-1] * n for _ in range(n)]
+        best = 0
         for i in range(n):
-            k = []
             for j in range(n):
-                k.append(-1)
-            visits.append(k)
-        lst = []
-        for i in range(len(_flatten(board))):
-            for j in range(len(_flatten(board))):
-                position = (i, j)
-                lst.append(self._undiscovered_blob_size(position,
-                                                        _flatten(board),
-                                                        visits))
-        return max(lst)
+                if visited[i][j] == -1:
+                    size = self._undiscovered_blob_size((i, j), flattened,
+                                                        visited)
+                    best = max(best, size)
+        return best
 
     def _undiscovered_blob_size(self, pos: Tuple[int, int],
                                 board: List[List[Tuple[int, int, int]]],
@@ -220,29 +599,60 @@ class BlobGoal(Goal):
 
         Update <visited> so that all cells that are visited are marked with
         either 0 or 1.
+
+        The blob is filled one vertical run of cells at a time, using an
+        explicit stack of seed cells instead of recursion, so that even a
+        single-colour board at a max_depth of 10 cannot overflow the stack.
         """
         colour = self.colour
-        i = pos[0]
-        j = pos[1]
-        not_on_board_i = i >= len(board) or i < 0
-        not_on_board_j = j >= len(board) or j < 0
-        if not_on_board_i or not_on_board_j:
-            return 0
-        elif visited[i][j] != -1:
-            return 0
-        elif board[i][j] != colour:
-            visited[i][j] = 0
-            return 0
-        else:
-            visited[i][j] = 1
-            pos1 = (pos[0], pos[1] + 1)
-            pos2 = (pos[0], pos[1] - 1)
-            pos3 = (pos[0] + 1, pos[1])
-            pos4 = (pos[0] - 1, pos[1])
-            return 1 + self._undiscovered_blob_size(pos1, board, visited) + \
-                self._undiscovered_blob_size(pos2, board, visited) + \
-                self._undiscovered_blob_size(pos3, board, visited) + \
-                self._undiscovered_blob_size(pos4, board, visited)
+        n = len(board)
+        size = 0
+        stack = [pos]
+        while stack:
+            i, j = stack.pop()
+            if not (0 <= i < n and 0 <= j < n) or visited[i][j] != -1:
+                continue
+            column = board[i]
+            seen = visited[i]
+            if column[j] != colour:
+                seen[j] = 0
+                continue
+
+            # Extend the run of target cells above and below (i, j).
+            top = j
+            while top > 0 and seen[top - 1] == -1 and \
+                    column[top - 1] == colour:
+                top -= 1
+            bottom = j
+            while bottom < n - 1 and seen[bottom + 1] == -1 and \
+                    column[bottom + 1] == colour:
+                bottom += 1
+            for k in range(top, bottom + 1):
+                seen[k] = 1
+            size += bottom - top + 1
+            if top > 0 and seen[top - 1] == -1:
+                seen[top - 1] = 0
+            if bottom < n - 1 and seen[bottom + 1] == -1:
+                seen[bottom + 1] = 0
+
+            # Push one seed for every run of unvisited target cells beside
+            # this run in the neighbouring columns.
+            for ni in (i - 1, i + 1):
+                if 0 <= ni < n:
+                    neighbour = board[ni]
+                    neighbour_seen = visited[ni]
+                    in_run = False
+                    for k in range(top, bottom + 1):
+                        if neighbour_seen[k] != -1:
+                            in_run = False
+                        elif neighbour[k] == colour:
+                            if not in_run:
+                                stack.append((ni, k))
+                                in_run = True
+                        else:
+                            neighbour_seen[k] = 0
+                            in_run = False
+        return size
 
     def description(self) -> str:
         """Returns a description of the player's goal, in which the player
@@ -253,13 +663,76 @@ class BlobGoal(Goal):
                'blocks of colour ' + c + '.'
 
 
+class ScoreCache:
+    """A bounded cache of goal scores, keyed by the state of the board.
+
+    Scores are looked up by the type and colour of the goal and by the
+    subtree_hash of the board, so any two boards with the same structure and
+    colours share an entry. When the cache is full, the least recently used
+    score is evicted.
+
+    === Public Attributes ===
+    capacity:
+        The maximum number of scores that are kept.
+    hits:
+        The number of scores that were found in the cache.
+    misses:
+        The number of scores that had to be computed.
+
+    === Private Attributes ===
+    _scores:
+        The cached scores, from least to most recently used.
+
+    === Representation Invariants ===
+    - capacity >= 1
+    - len(_scores) <= capacity
+    """
+    capacity: int
+    hits: int
+    misses: int
+    _scores: OrderedDict
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """Initialize an empty cache that holds at most <capacity> scores.
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+
+    def score(self, goal: Goal, board: Block) -> int:
+        """Return goal.score(board), computing it only if it is not already
+        in this cache.
+        """
+        key = (type(goal), goal.colour, board.max_depth - board.level,
+               board.subtree_hash())
+        if key in self._scores:
+            self.hits += 1
+            self._scores.move_to_end(key)
+            return self._scores[key]
+
+        self.misses += 1
+        score = goal.score(board)
+        self._scores[key] = score
+        if len(self._scores) > self.capacity:
+            self._scores.popitem(last=False)
+        return score
+
+    def clear(self) -> None:
+        """Remove every score from this cache, and reset its counters.
+        """
+        self._scores.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'block', 'settings',
-            'math', '__future__'
+            'math', '__future__', 'numpy', 'collections'
         ],
         'max-attributes': 15
     })
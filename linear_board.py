@@ -0,0 +1,374 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the LinearBoard class, a Blocky board stored as flat arrays
+instead of a tree of Block objects. It is meant for simulations that make and
+copy a very large number of boards.
+"""
+from __future__ import annotations
+from array import array
+from typing import List, Optional, Tuple
+import random
+import math
+
+from block import Block
+from settings import COLOUR_LIST
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for LinearBoard.to_raster
+    np = None
+
+# The value in LinearBoard.colours of a node that is subdivided, and the value
+# in LinearBoard.children of a node that is not.
+NO_VALUE = -1
+
+# The order in which the four children of a node are rearranged by each
+# structural move: child i of the result is child order[i] of the original.
+_SWAP_ORDER = {0: (1, 0, 3, 2), 1: (3, 2, 1, 0)}
+_ROTATE_ORDER = {1: (1, 2, 3, 0), 3: (3, 0, 1, 2)}
+
+
+def generate_linear_board(max_depth: int, size: int) -> LinearBoard:
+    """Return a new game board with a depth of <max_depth> and dimensions of
+    <size> by <size>.
+
+    Given the same state of the random module, this makes the same board as
+    block.generate_board.
+
+    >>> board = generate_linear_board(3, 750)
+    >>> board.max_depth
+    3
+    >>> board.size
+    750
+    """
+    colour = COLOUR_LIST.index(random.choice(COLOUR_LIST))
+    board = LinearBoard(size, max_depth, colour)
+    board.smash(0)
+
+    return board
+
+
+def from_block(block: Block) -> LinearBoard:
+    """Return a new LinearBoard with the same structure and colours as the
+    board <block>.
+
+    Raise ValueError if <block> contains a colour that is not in COLOUR_LIST.
+    """
+    board = LinearBoard(block.size, block.max_depth - block.level, NO_VALUE)
+    stack = [(block, 0)]
+    while stack:
+        b, node = stack.pop()
+        if len(b.children) == 0:
+            board.colours[node] = COLOUR_LIST.index(b.colour)
+        else:
+            first = board.new_children(node)
+            for i in range(4):
+                stack.append((b.children[i], first + i))
+
+    return board
+
+
+class LinearBoard:
+    """A Blocky board stored as a linear quadtree.
+
+    Every block on the board is a node, identified by an int. The root of the
+    board is node 0. The four children of a subdivided node are always stored
+    in four consecutive nodes, in the same order as Block.children: the
+    upper-right child, upper-left child, lower-left child, and lower-right
+    child. Moving a whole subtree therefore only moves the two numbers that
+    describe the root of that subtree, and copying a board only copies its
+    arrays.
+
+    Unlike a Block, a node does not store its position or size, since these
+    follow from its path from the root.
+
+    === Public Attributes ===
+    size:
+        The height and width of the board, in pixels.
+    max_depth:
+        The deepest level allowed on the board.
+    colours:
+        colours[node] is the index in COLOUR_LIST of the colour of <node>, or
+        NO_VALUE if <node> is subdivided.
+    children:
+        children[node] is the first of the four children of <node>, or
+        NO_VALUE if <node> is not subdivided.
+    levels:
+        levels[node] is the level of <node> on the board.
+
+    === Private Attributes ===
+    _free:
+        The first nodes of groups of four consecutive nodes that are no longer
+        part of the board, and can be reused.
+
+    === Representation Invariants ===
+    - len(colours) == len(children) == len(levels)
+    - colours[node] == NO_VALUE iff children[node] != NO_VALUE
+    - levels[children[node] + i] == levels[node] + 1 for i in range(4)
+    - levels[node] <= max_depth
+    """
+    size: int
+    max_depth: int
+    colours: array
+    children: array
+    levels: array
+    _free: List[int]
+
+    def __init__(self, size: int, max_depth: int, colour: int) -> None:
+        """Initialize this board to be a single block with dimensions <size> by
+        <size>, the colour with index <colour> in COLOUR_LIST, and a maximum
+        depth of <max_depth>.
+        """
+        self.size = size
+        self.max_depth = max_depth
+        self.colours = array('b', [colour])
+        self.children = array('i', [NO_VALUE])
+        self.levels = array('b', [0])
+        self._free = []
+
+    def copy(self) -> LinearBoard:
+        """Return a new LinearBoard that is a copy of this board.
+        """
+        board = LinearBoard(self.size, self.max_depth, NO_VALUE)
+        board.colours = self.colours[:]
+        board.children = self.children[:]
+        board.levels = self.levels[:]
+        board._free = self._free.copy()
+        return board
+
+    def new_children(self, node: int) -> int:
+        """Subdivide <node> into four new children, and return the first of
+        them.
+
+        The children have no colour yet, and nodes that were released by
+        combine are reused before the arrays are extended.
+
+        Precondition: <node> has no children and levels[node] < max_depth
+        """
+        level = self.levels[node] + 1
+        if self._free:
+            first = self._free.pop()
+            for i in range(4):
+                self.colours[first + i] = NO_VALUE
+                self.children[first + i] = NO_VALUE
+                self.levels[first + i] = level
+        else:
+            first = len(self.colours)
+            self.colours.extend([NO_VALUE] * 4)
+            self.children.extend([NO_VALUE] * 4)
+            self.levels.extend([level] * 4)
+
+        self.colours[node] = NO_VALUE
+        self.children[node] = first
+        return first
+
+    def node_at(self, location: Tuple[int, int], level: int) -> Optional[int]:
+        """Return the node that is at <level> and includes <location>, using
+        the same rules as player._get_block.
+
+        If no node can be found at <location>, return None.
+        """
+        x, y = 0, 0
+        size = self.size
+        if not (0 <= location[0] < size and 0 <= location[1] < size):
+            return None
+
+        node = 0
+        while self.levels[node] < level and \
+                self.children[node] != NO_VALUE:
+            size = round(size / 2.0)
+            right = location[0] >= x + size
+            down = location[1] >= y + size
+            if down:
+                child = 3 if right else 2
+            else:
+                child = 0 if right else 1
+            x += size if right else 0
+            y += size if down else 0
+            node = self.children[node] + child
+
+        return node
+
+    def _permute(self, first: int, order: Tuple[int, int, int, int]) -> None:
+        """Rearrange the four nodes starting at <first> so that node i becomes
+        what node order[i] was.
+        """
+        colours = [self.colours[first + i] for i in order]
+        children = [self.children[first + i] for i in order]
+        for i in range(4):
+            self.colours[first + i] = colours[i]
+            self.children[first + i] = children[i]
+
+    def smashable(self, node: int) -> bool:
+        """Return True iff <node> can be smashed.
+        """
+        return self.levels[node] != self.max_depth and \
+            self.children[node] == NO_VALUE
+
+    def smash(self, node: int) -> bool:
+        """Sub-divide <node> so that it has four randomly generated children,
+        following the same rules and random choices as Block.smash.
+
+        Return True iff the smash was performed.
+        """
+        if not self.smashable(node):
+            return False
+
+        level = self.levels[node]
+        if random.random() < math.exp(-0.25 * level):
+            first = self.new_children(node)
+            for i in range(4):
+                self.colours[first + i] = random.randint(0,
+                                                         len(COLOUR_LIST) - 1)
+                self.smash(first + i)
+        else:
+            self.colours[node] = random.randint(0, len(COLOUR_LIST) - 1)
+
+        return True
+
+    def swap(self, node: int, direction: int) -> bool:
+        """Swap the children of <node>, vertically if <direction> is 1 and
+        horizontally if <direction> is 0.
+
+        Return True iff the swap was performed.
+        """
+        if self.children[node] == NO_VALUE:
+            return False
+
+        self._permute(self.children[node], _SWAP_ORDER[direction])
+        return True
+
+    def rotate(self, node: int, direction: int) -> bool:
+        """Rotate <node> and all its descendants, clockwise if <direction> is 1
+        and counter-clockwise if <direction> is 3.
+
+        Return True iff the rotate was performed.
+        """
+        if self.children[node] == NO_VALUE:
+            return False
+
+        order = _ROTATE_ORDER[direction]
+        stack = [node]
+        while stack:
+            first = self.children[stack.pop()]
+            self._permute(first, order)
+            for i in range(4):
+                if self.children[first + i] != NO_VALUE:
+                    stack.append(first + i)
+
+        return True
+
+    def paint(self, node: int, colour: int) -> bool:
+        """Change the colour of <node> to the colour with index <colour> in
+        COLOUR_LIST iff it is a leaf at a level of max_depth and its colour is
+        different.
+
+        Return True iff the colour of <node> was changed.
+        """
+        if self.levels[node] == self.max_depth and \
+                self.colours[node] != colour:
+            self.colours[node] = colour
+            return True
+        else:
+            return False
+
+    def combine(self, node: int) -> bool:
+        """Turn <node> into a leaf based on the majority colour of its
+        children, following the same rules as Block.combine.
+
+        Return True iff <node> was turned into a leaf.
+        """
+        first = self.children[node]
+        if first == NO_VALUE or self.levels[node] != self.max_depth - 1:
+            return False
+
+        counts = [0] * len(COLOUR_LIST)
+        for i in range(4):
+            counts[self.colours[first + i]] += 1
+        most = max(counts)
+        if counts.count(most) != 1:
+            return False
+
+        self.colours[node] = counts.index(most)
+        self.children[node] = NO_VALUE
+        self._free.append(first)
+        return True
+
+    def to_block(self) -> Block:
+        """Return a new Block that represents this board.
+        """
+        return self._to_block(0, (0, 0), self.size)
+
+    def _to_block(self, node: int, position: Tuple[int, int],
+                  size: int) -> Block:
+        """Return a new Block that represents the subtree rooted at <node>,
+        with the given <position> and <size>.
+        """
+        if self.children[node] == NO_VALUE:
+            return Block(position, size, COLOUR_LIST[self.colours[node]],
+                         self.levels[node], self.max_depth)
+
+        block = Block(position, size, None, self.levels[node],
+                      self.max_depth)
+        positions = block._children_positions()
+        child_size = block._child_size()
+        first = self.children[node]
+        block.children = [self._to_block(first + i, positions[i], child_size)
+                          for i in range(4)]
+        return block
+
+    def to_raster(self) -> np.ndarray:
+        """Return a two-dimensional NumPy array of uint8 representing this
+        board as rows and columns of unit cells, laid out in the same way as
+        by goal._flatten_indices, so that it can be scored by
+        Goal.score_raster without making any Blocks.
+
+        Raise ImportError if numpy is not installed.
+        """
+        if np is None:
+            raise ImportError('LinearBoard.to_raster requires numpy')
+        n = 2 ** self.max_depth
+        raster = np.empty((n, n), dtype=np.uint8)
+        stack = [(0, 0, 0, n)]
+        while stack:
+            node, x, y, n = stack.pop()
+            first = self.children[node]
+            if first == NO_VALUE:
+                raster[x:x + n, y:y + n] = self.colours[node]
+            else:
+                half = n // 2
+                stack.append((first, x + half, y, half))
+                stack.append((first + 1, x, y, half))
+                stack.append((first + 2, x, y + half, half))
+                stack.append((first + 3, x + half, y + half, half))
+        return raster
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'random', 'typing', '__future__', 'math',
+            'array', 'block', 'settings', 'numpy'
+        ],
+        'max-attributes': 15
+    })
@@ -56,6 +56,9 @@ HIGHLIGHT_THICKNESS = 5
 # The number of seconds a move is animated for.
 ANIMATION_DURATION = 1
 
+# The number of goal scores that a game keeps in its score cache.
+SCORE_CACHE_CAPACITY = 1024
+
 
 def colour_name(colour: Tuple[int, int, int]) -> str:
     """Return the colour name associated with this colour value, or the empty
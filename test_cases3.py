@@ -0,0 +1,951 @@
+import pytest
+import pygame
+from typing import List, Tuple, Optional
+from block import Block
+import copy
+import pickle
+import random
+import threading
+import time
+from block import deserialize_board, generate_board, serialize_board
+from goal import BlobGoal, PerimeterGoal, ScoreCache, _flatten, \
+    _flatten_indices, _sides_touched, largest_blobs
+from linear_board import from_block, generate_linear_board
+from player import _distinct_moves, _get_block, _is_no_op, MCTSPlayer, \
+    Player, RandomPlayer, SearchPlayer, SmartPlayer
+from blocky import AnimateMoveState, GameData, MainState
+from settings import COLOUR_LIST
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+PACIFIC_POINT = (1, 128, 181)
+OLD_OLIVE = (138, 151, 71)
+REAL_RED = (199, 44, 58)
+MELON_MAMBO = (234, 62, 112)
+DAFFODIL_DELIGHT = (255, 211, 92)
+TEMPTING_TURQUOISE = (75, 196, 213)
+
+
+def set_children(block: Block, colours: List[Optional[Tuple[int, int, int]]]) \
+        -> None:
+    """Set the children at <level> for <block> using the given <colours>.
+
+    Precondition:
+        - len(colours) == 4
+        - block.level + 1 <= block.max_depth
+    """
+    size = block._child_size()
+    positions = block._children_positions()
+    level = block.level + 1
+    depth = block.max_depth
+
+    block.children = []  # Potentially discard children
+    for i in range(4):
+        b = Block(positions[i], size, colours[i], level, depth)
+        block.children.append(b)
+
+
+def two_red_blobs() -> Block:
+    """A depth 2 board with a red blob of 4 in the upper left, and a red blob
+    of 5 in the lower right, separated by a ring of other colours.
+    """
+    b = Block((0, 0), 750, None, 0, 2)
+    set_children(b, [None, REAL_RED, OLD_OLIVE, REAL_RED])
+    set_children(b.children[0], [OLD_OLIVE, OLD_OLIVE, OLD_OLIVE, REAL_RED])
+    return b
+
+
+# TESTS FOR BLOB GOAL #
+def test_blob_goal_picks_largest_blob() -> None:
+    b = two_red_blobs()
+    assert BlobGoal(REAL_RED).score(b) == 5
+    assert BlobGoal(OLD_OLIVE).score(b) == 4
+    assert BlobGoal(BLACK).score(b) == 0
+
+
+def test_blob_goal_max_depth_10_single_colour() -> None:
+    # A 1024 x 1024 blob, far beyond what a recursive flood fill can handle.
+    b = Block((0, 0), 750, REAL_RED, 0, 10)
+    assert BlobGoal(REAL_RED).score(b) == 1024 * 1024
+
+
+def test_blob_goal_max_depth_10_fragmented() -> None:
+    # A board subdivided along one path down to the unit cells, scored by the
+    # scanline fill on the 1024 x 1024 flattened board.
+    random.seed(2)
+    b = Block((0, 0), 750, None, 0, 10)
+    block = b
+    for level in range(10):
+        colours = [random.choice([REAL_RED, OLD_OLIVE]) for _ in range(4)]
+        if level < 9:
+            colours[level % 4] = None
+        set_children(block, colours)
+        if level < 9:
+            block = block.children[level % 4]
+    goal = BlobGoal(REAL_RED)
+    assert goal._score_flattened(_flatten(b)) == goal.score(b) == 688128
+
+
+def test_blob_size_visits_whole_snake() -> None:
+    # A blob that winds up and down every column of the flattened board.
+    n = 8
+    board = [[REAL_RED] * n for _ in range(n)]
+    for i in range(1, n, 2):
+        gap = 0 if i % 4 == 1 else n - 1
+        for j in range(n):
+            if j != gap:
+                board[i][j] = OLD_OLIVE
+    visited = [[-1] * n for _ in range(n)]
+    expected = sum(row.count(REAL_RED) for row in board)
+    goal = BlobGoal(REAL_RED)
+    assert goal._undiscovered_blob_size((0, 0), board, visited) == expected
+    for i in range(n):
+        for j in range(n):
+            assert visited[i][j] in (-1, 0, 1)
+            if visited[i][j] == 1:
+                assert board[i][j] == REAL_RED
+
+
+def test_largest_blobs_every_colour() -> None:
+    b = two_red_blobs()
+    blobs = largest_blobs(b)
+    assert blobs[REAL_RED] == 5
+    assert blobs[OLD_OLIVE] == 4
+    for colour in COLOUR_LIST:
+        if colour not in (REAL_RED, OLD_OLIVE):
+            assert blobs[colour] == 0
+
+
+def test_largest_blobs_matches_blob_goal() -> None:
+    random.seed(148)
+    for _ in range(10):
+        b = generate_board(4, 750)
+        blobs = largest_blobs(b)
+        for colour in COLOUR_LIST:
+            assert blobs[colour] == BlobGoal(colour).score(b)
+
+
+def test_blob_goal_tree_matches_flattened() -> None:
+    random.seed(2020)
+    for _ in range(20):
+        b = generate_board(5, 750)
+        flattened = _flatten(b)
+        for colour in COLOUR_LIST:
+            goal = BlobGoal(colour)
+            assert goal.score(b) == goal._score_flattened(flattened)
+
+
+def test_blob_goal_joins_leaves_of_different_sizes() -> None:
+    # A level 1 leaf touching two level 2 leaves and one level 3 leaf of the
+    # same colour, across both seams of the board.
+    b = Block((0, 0), 750, None, 0, 3)
+    set_children(b, [None, REAL_RED, None, OLD_OLIVE])
+    set_children(b.children[0], [OLD_OLIVE, REAL_RED, REAL_RED, OLD_OLIVE])
+    set_children(b.children[2], [None, OLD_OLIVE, OLD_OLIVE, OLD_OLIVE])
+    set_children(b.children[2].children[0],
+                 [OLD_OLIVE, REAL_RED, OLD_OLIVE, OLD_OLIVE])
+    assert BlobGoal(REAL_RED).score(b) == 16 + 4 + 4 + 1
+    assert BlobGoal(OLD_OLIVE).score(b) == 16 + 8 + 4 + 4 + 4 + 3
+
+
+def flattened_perimeter(b: Block, colour: Tuple[int, int, int]) -> int:
+    flattened = _flatten(b)
+    n = len(flattened)
+    edges = [flattened[0], flattened[-1],
+             [column[0] for column in flattened],
+             [column[-1] for column in flattened]]
+    return sum(edge.count(colour) for edge in edges)
+
+
+def test_perimeter_goal_matches_flattened() -> None:
+    random.seed(230)
+    for _ in range(20):
+        b = generate_board(5, 750)
+        for colour in COLOUR_LIST:
+            assert PerimeterGoal(colour).score(b) == \
+                flattened_perimeter(b, colour)
+
+
+def test_perimeter_goal_ignores_interior() -> None:
+    b = two_red_blobs()
+    # Each of the two red quadrants has a corner and two more edge cells, and
+    # one more red cell sits on the right edge.
+    assert PerimeterGoal(REAL_RED).score(b) == 2 * (2 + 1 + 1) + 1
+    assert PerimeterGoal(OLD_OLIVE).score(b) == (2 + 1 + 1) + (2 + 1)
+
+
+def test_flatten_indices_matches_flatten() -> None:
+    np = pytest.importorskip('numpy')
+    random.seed(11)
+    b = generate_board(4, 750)
+    raster = _flatten_indices(b)
+    assert raster.dtype == np.uint8
+    assert raster.shape == (16, 16)
+    assert raster.flags['C_CONTIGUOUS']
+    flattened = _flatten(b)
+    for i in range(16):
+        for j in range(16):
+            assert COLOUR_LIST[raster[i, j]] == flattened[i][j]
+
+
+def test_flatten_indices_unknown_colour() -> None:
+    pytest.importorskip('numpy')
+    with pytest.raises(ValueError):
+        _flatten_indices(Block((0, 0), 750, BLACK, 0, 1))
+
+
+def test_score_raster_matches_score() -> None:
+    pytest.importorskip('numpy')
+    random.seed(7)
+    for _ in range(10):
+        b = generate_board(5, 750)
+        raster = _flatten_indices(b)
+        for colour in COLOUR_LIST:
+            assert BlobGoal(colour).score_raster(raster) == \
+                BlobGoal(colour).score(b)
+            assert PerimeterGoal(colour).score_raster(raster) == \
+                PerimeterGoal(colour).score(b)
+
+
+def test_score_raster_lone_block() -> None:
+    pytest.importorskip('numpy')
+    raster = _flatten_indices(Block((0, 0), 750, REAL_RED, 0, 0))
+    assert PerimeterGoal(REAL_RED).score_raster(raster) == 4
+    assert BlobGoal(REAL_RED).score_raster(raster) == 1
+    assert BlobGoal(OLD_OLIVE).score_raster(raster) == 0
+    assert BlobGoal(BLACK).score_raster(raster) == 0
+
+
+# TESTS FOR UPPER BOUNDS #
+def test_sides_touched() -> None:
+    b = two_red_blobs()
+    assert _sides_touched(b, b) == [0, 1, 2, 3]
+    assert _sides_touched(b, b.children[2]) == [1, 2]
+    assert _sides_touched(b, b.children[0].children[0]) == [0, 3]
+    assert _sides_touched(b, b.children[0].children[2]) == []
+
+
+def test_upper_bound_values() -> None:
+    b = two_red_blobs()
+    perimeter = PerimeterGoal(REAL_RED)
+    blob = BlobGoal(REAL_RED)
+    assert perimeter.upper_bound(b, b.children[2]) == 13
+    assert perimeter.upper_bound(b, b.children[1]) == 9
+    assert perimeter.upper_bound(b, b.children[0].children[2]) == 9
+    assert blob.upper_bound(b, b.children[2]) == 13
+    assert blob.upper_bound(b, b.children[1]) == 9
+    assert blob.upper_bound(b, b) == 16
+
+
+def test_upper_bound_holds_after_moves() -> None:
+    random.seed(3)
+    b = generate_board(3, 750)
+    goals = [BlobGoal(REAL_RED), PerimeterGoal(OLD_OLIVE)]
+    for _ in range(200):
+        block = _get_block(b, (random.randint(0, 749), random.randint(0, 749)),
+                           random.randint(0, 3))
+        action = random.choice([('rotate', 1), ('swap', 1), ('smash', None),
+                                ('paint', None), ('combine', None)])
+        for goal in goals:
+            bound = goal.upper_bound(b, block)
+            token = block.apply_move(action, goal.colour)
+            if token is not None:
+                assert goal.score(b) <= bound
+                block.undo_move(token)
+
+
+# TESTS FOR SCORE CACHE #
+def test_score_cache_hits_and_misses() -> None:
+    cache = ScoreCache(4)
+    b = two_red_blobs()
+    blob = BlobGoal(REAL_RED)
+    perimeter = PerimeterGoal(REAL_RED)
+    assert cache.score(blob, b) == 5
+    assert cache.score(perimeter, b) == 9
+    assert cache.score(blob, b) == 5
+    assert cache.score(blob, two_red_blobs()) == 5
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert b.children[0].swap(0)
+    assert cache.score(perimeter, b) == PerimeterGoal(REAL_RED).score(b)
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_score_cache_evicts_least_recently_used() -> None:
+    cache = ScoreCache(2)
+    b = two_red_blobs()
+    goals = [BlobGoal(REAL_RED), BlobGoal(OLD_OLIVE), BlobGoal(BLACK)]
+    cache.score(goals[0], b)
+    cache.score(goals[1], b)
+    cache.score(goals[0], b)
+    cache.score(goals[2], b)
+    assert len(cache._scores) == 2
+    cache.score(goals[0], b)
+    assert cache.hits == 2
+    cache.score(goals[1], b)
+    assert cache.misses == 4
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache._scores)) == (0, 0, 0)
+
+
+
+def test_smart_player_uses_game_score_cache() -> None:
+    b = two_red_blobs()
+    player = SmartPlayer(0, BlobGoal(REAL_RED), 2)
+    data = GameData(b, [player], cache_capacity=8)
+    assert data.score_cache.capacity == 8
+    data.calculate_score(player.id)
+    assert_valid_move(player, b, player.generate_move(b))
+    assert (data.score_cache.hits, data.score_cache.misses) == (1, 1)
+
+# TESTS FOR BLOCK #
+def test_block_has_fixed_slots() -> None:
+    b = Block((0, 0), 750, REAL_RED, 0, 1)
+    assert not hasattr(b, '__dict__')
+    with pytest.raises(AttributeError):
+        b.colour_name = 'Real Red'
+
+
+def assert_positions_consistent(b: Block) -> None:
+    if b.children:
+        for child, position in zip(b.children, b._children_positions()):
+            assert child.position == position
+            assert_positions_consistent(child)
+
+
+def test_positions_follow_moves_lazily() -> None:
+    b = two_red_blobs()
+    grandchild = b.children[0].children[3]
+    assert grandchild.position == (563, 188)
+    assert b.swap(0)
+    # The grandchild is only moved once its position is read, or it is
+    # reached from the root again.
+    assert grandchild._position == (563, 188)
+    assert grandchild.position == (188, 188)
+    assert b.children[1].children[3] is grandchild
+    assert b.rotate(1)
+    assert grandchild.position == (375, 188)
+    assert b.children[0].children[2] is grandchild
+    assert_positions_consistent(b)
+    b.position = (10, 20)
+    assert_positions_consistent(b)
+    assert grandchild.position == (375 + 10, 188 + 20)
+
+
+def test_rotate_is_lazy() -> None:
+    random.seed(99)
+    b = generate_board(6, 750)
+    expected = b.create_copy()
+    order = list(b._children)
+    assert b.rotate(1)
+    assert b.rotate(1)
+    assert b.rotate(3)
+    assert b._children == order
+    expected.rotate(1)
+    assert b == expected
+    assert b.rotate(3)
+    child = [c for c in b.children if c.children][0]
+    assert child.rotate(1)
+    assert child.rotate(3)
+    expected.rotate(3)
+    assert b == expected
+
+
+def test_move_after_ancestor_rotate() -> None:
+    b = two_red_blobs()
+    expected = two_red_blobs()
+    child = b.children[0]
+    assert b.rotate(1)
+    # <child> is changed before the rotation of <b> has reached it.
+    assert child.swap(1)
+    expected.rotate(1)
+    assert expected.children[3].swap(1)
+    assert b == expected
+
+
+
+def test_held_child_follows_ancestor_rotate() -> None:
+    random.seed(3)
+    b = full_board(2)
+    expected = b.create_copy()
+    expected.rotate(1)
+    held = b.children[1]
+    b.rotate(1)
+    assert held == expected.children[0]
+    assert held.subtree_hash() == expected.children[0].subtree_hash()
+    assert [child.colour for child in held.children] == \
+           [child.colour for child in expected.children[0].children]
+    assert BlobGoal(REAL_RED).score(held) == \
+           BlobGoal(REAL_RED).score(expected.children[0])
+
+def test_subtree_hash_ignores_position() -> None:
+    b = two_red_blobs()
+    other = Block((10, 10), 750, None, 0, 2)
+    set_children(other, [None, REAL_RED, OLD_OLIVE, REAL_RED])
+    set_children(other.children[0], [OLD_OLIVE, OLD_OLIVE, OLD_OLIVE,
+                                     REAL_RED])
+    assert b.subtree_hash() == other.subtree_hash()
+    assert b.children[1].subtree_hash() == b.children[3].subtree_hash()
+    assert b.children[1].subtree_hash() != b.children[2].subtree_hash()
+
+
+def test_subtree_hash_follows_moves() -> None:
+    b = two_red_blobs()
+    before = b.subtree_hash()
+    assert b.children[0].swap(0)
+    assert b.subtree_hash() != before
+    assert b.children[0].swap(0)
+    assert b.subtree_hash() == before
+    assert b.rotate(1)
+    assert b.subtree_hash() != before
+    assert b.rotate(3)
+    assert b.subtree_hash() == before
+    b.children[1].colour = OLD_OLIVE
+    assert b.subtree_hash() != before
+
+
+def test_subtree_hash_follows_children_list() -> None:
+    b = two_leaf_colours()
+    other = two_leaf_colours()
+    other.children[1].colour = REAL_RED
+    assert b != other
+    b.children[1] = Block((0, 0), 375, REAL_RED, 1, 1)
+    assert b.children[1]._parent is b
+    assert b == other
+    assert BlobGoal(REAL_RED).score(b) == 3
+    b.children.pop()
+    b.children.append(Block((0, 0), 375, OLD_OLIVE, 1, 1))
+    assert b.children[3].position == (375, 375)
+    assert b != other
+
+
+
+def test_block_deepcopy_and_pickle() -> None:
+    b = two_leaf_colours()
+    for other in (copy.deepcopy(b), pickle.loads(pickle.dumps(b))):
+        assert other == b
+        assert other.children[0]._parent is other
+        other.children[1] = Block((0, 0), 375, REAL_RED, 1, 1)
+        assert other.children[1].position == (0, 0)
+        assert other != b
+
+
+def test_leaves_share_no_children() -> None:
+    b = two_leaf_colours()
+    leaf = b.children[0]
+    assert leaf._children is b.children[1]._children
+    leaf.children.append(Block((0, 0), 375, REAL_RED, 1, 1))
+    assert len(leaf.children) == 1
+    assert b.children[1].children == []
+    old = b.children
+    b.children = []
+    old.append(Block((0, 0), 375, REAL_RED, 1, 1))
+    assert b.children == []
+
+def test_subtree_hash_only_recomputes_path() -> None:
+    random.seed(5)
+    b = generate_board(5, 750)
+    b.subtree_hash()
+    leaf = _get_block(b, (0, 0), 5)
+    siblings = [child for child in b.children
+                if not (child.position[0] <= 0 < child.position[0] +
+                        child.size and child.position[1] == 0)]
+    leaf.colour = BLACK if leaf.colour != BLACK else REAL_RED
+    assert b._hash is None and leaf._hash is None
+    assert all(child._hash is not None for child in siblings)
+
+
+def test_goal_scores_only_recompute_path() -> None:
+    b = Block((0, 0), 750, None, 0, 3)
+    set_children(b, [None, None, REAL_RED, OLD_OLIVE])
+    set_children(b.children[0], [None, REAL_RED, OLD_OLIVE, REAL_RED])
+    set_children(b.children[0].children[0],
+                 [REAL_RED, OLD_OLIVE, OLD_OLIVE, REAL_RED])
+    set_children(b.children[1], [None, OLD_OLIVE, REAL_RED, OLD_OLIVE])
+    set_children(b.children[1].children[0],
+                 [OLD_OLIVE, OLD_OLIVE, REAL_RED, REAL_RED])
+    blob = BlobGoal(REAL_RED)
+    perimeter = PerimeterGoal(REAL_RED)
+    assert blob.score(b) == blob._score_flattened(_flatten(b))
+    assert perimeter.score(b) == flattened_perimeter(b, REAL_RED)
+    untouched = b.children[1]._cache
+    assert untouched
+    # Nothing is stored on leaves.
+    assert b.children[2]._cache is None
+    assert b.children[1].children[0].children[0]._cache is None
+    assert b.children[0].children[0].children[3].paint(OLD_OLIVE)
+    assert b._cache is None and b.children[0]._cache is None
+    assert b.children[1]._cache is untouched
+    assert blob.score(b) == blob._score_flattened(_flatten(b))
+    assert perimeter.score(b) == flattened_perimeter(b, REAL_RED)
+
+
+def test_goal_scores_follow_rotate() -> None:
+    random.seed(11)
+    b = generate_board(4, 750)
+    goals = [BlobGoal(colour) for colour in COLOUR_LIST] + \
+        [PerimeterGoal(colour) for colour in COLOUR_LIST]
+    for goal in goals:
+        goal.score(b)
+    for block in b.children + [b]:
+        block.rotate(1)
+        for goal in goals:
+            if isinstance(goal, BlobGoal):
+                assert goal.score(b) == goal._score_flattened(_flatten(b))
+            else:
+                assert goal.score(b) == flattened_perimeter(b, goal.colour)
+
+
+def test_colour_counts_follow_moves() -> None:
+    b = two_red_blobs()
+    assert b.colour_counts() == {REAL_RED: 9, OLD_OLIVE: 7}
+    assert b.children[2].colour_counts() == {OLD_OLIVE: 4}
+    assert b.children[0].children[3].paint(OLD_OLIVE)
+    assert b.colour_counts() == {REAL_RED: 8, OLD_OLIVE: 8}
+    assert b.children[0].combine()
+    assert b.children[0].colour == OLD_OLIVE
+    assert b.colour_counts() == {REAL_RED: 8, OLD_OLIVE: 8}
+    assert b.rotate(1)
+    assert b.colour_counts() == {REAL_RED: 8, OLD_OLIVE: 8}
+
+
+def test_combine_colours_not_in_colour_list() -> None:
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [BLACK, WHITE, BLACK, REAL_RED])
+    assert b.combine()
+    assert b.colour == BLACK
+    b.colour = None
+    set_children(b, [BLACK, WHITE, WHITE, BLACK])
+    assert not b.combine()
+
+
+# TESTS FOR MOVE ENUMERATION #
+def assert_valid_move(player: Player, b: Block,
+                      move: Tuple[str, Optional[int], Block]) -> None:
+    if move[0] != 'pass':
+        copy = b.create_copy()
+        block = _get_block(copy, move[2].position, move[2].level)
+        assert block.apply_move(move[:2], player.goal.colour) is not None
+
+
+def test_distinct_moves_two_red_blobs() -> None:
+    b = two_red_blobs()
+    player = SmartPlayer(0, BlobGoal(REAL_RED), 1)
+    moves = _distinct_moves(player, b)
+    assert len(moves) == 15
+    assert len({(action, id(block)) for action, block in moves}) == 15
+    for action, block in moves:
+        assert_valid_move(player, b, (action[0], action[1], block))
+    assert sorted(action[0] for action, block in moves
+                  if block is b.children[0]) == ['combine', 'rotate',
+                                                  'rotate', 'swap', 'swap']
+    assert b == two_red_blobs()
+
+
+def test_smart_player_full_enumeration() -> None:
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [REAL_RED, OLD_OLIVE, OLD_OLIVE, REAL_RED])
+    player = SmartPlayer(0, BlobGoal(REAL_RED), 100)
+    action, direction, block = player.generate_move(b)
+    assert action == 'paint'
+    assert block in b.children
+    assert block.paint(REAL_RED)
+    assert BlobGoal(REAL_RED).score(b) == 3
+
+
+def test_distinct_moves_skip_no_ops() -> None:
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [REAL_RED, REAL_RED, REAL_RED, REAL_RED])
+    player = RandomPlayer(0, BlobGoal(REAL_RED))
+    assert _is_no_op(b, ('rotate', 1))
+    assert _is_no_op(b, ('swap', 0))
+    assert _distinct_moves(player, b) == [(('combine', None), b)]
+    set_children(b, [REAL_RED, OLD_OLIVE, REAL_RED, OLD_OLIVE])
+    assert not _is_no_op(b, ('rotate', 3))
+    assert sorted(action for action, block in _distinct_moves(player, b)) == \
+        [('paint', None), ('paint', None), ('rotate', 1), ('swap', 0),
+         ('swap', 1)]
+    set_children(b, [REAL_RED, REAL_RED, OLD_OLIVE, OLD_OLIVE])
+    assert _is_no_op(b, ('swap', 0))
+    assert not _is_no_op(b, ('swap', 1))
+
+
+def test_random_player_never_picks_no_op() -> None:
+    random.seed(2)
+    b = Block((0, 0), 750, None, 0, 2)
+    set_children(b, [None, REAL_RED, REAL_RED, REAL_RED])
+    set_children(b.children[0], [REAL_RED, REAL_RED, REAL_RED, REAL_RED])
+    player = RandomPlayer(0, PerimeterGoal(REAL_RED))
+    for _ in range(50):
+        player._proceed = True
+        action, direction, block = player.generate_move(b)
+        if block is b.children[0]:
+            assert action == 'combine'
+        else:
+            assert block is b or action == 'smash'
+    lone = Block((0, 0), 750, REAL_RED, 0, 0)
+    player._proceed = True
+    assert player.generate_move(lone) == ('pass', None, lone)
+
+
+def full_board(max_depth: int) -> Block:
+    b = Block((0, 0), 750, None, 0, max_depth)
+    blocks = [b]
+    while blocks:
+        block = blocks.pop()
+        if block.level + 1 == max_depth:
+            set_children(block, [random.choice(COLOUR_LIST) for _ in range(4)])
+        else:
+            set_children(block, [None, None, None, None])
+            blocks.extend(block.children)
+    return b
+
+
+def test_serialize_board_round_trip() -> None:
+    b = two_red_blobs()
+    b.children[2].colour = BLACK
+    data = serialize_board(b)
+    assert len(data[-1]) == 9
+    assert deserialize_board(data) == b
+    assert deserialize_board(serialize_board(b.children[0])) == b.children[0]
+    random.seed(12)
+    b = generate_board(5, 750)
+    assert deserialize_board(serialize_board(b)) == b
+
+
+def test_smart_player_workers_same_move() -> None:
+    random.seed(4)
+    b = full_board(3)
+    moves = []
+    for workers in [None, 3]:
+        random.seed(9)
+        player = SmartPlayer(0, BlobGoal(REAL_RED), 20, workers)
+        moves.append(player.generate_move(b))
+        player.close()
+        assert player._pool is None
+    assert moves[0][:2] == moves[1][:2]
+    assert moves[0][2] is moves[1][2]
+    assert moves[0][0] != 'pass'
+
+
+def test_smart_player_time_limit() -> None:
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [REAL_RED, OLD_OLIVE, OLD_OLIVE, REAL_RED])
+    player = SmartPlayer(0, BlobGoal(REAL_RED), 1, time_limit=10)
+    action, direction, block = player.generate_move(b)
+    assert action == 'paint'
+    # Even with no time at all, one move is scored.
+    b = Block((0, 0), 750, OLD_OLIVE, 0, 0)
+    player = SmartPlayer(0, BlobGoal(REAL_RED), 1, time_limit=0)
+    assert player.generate_move(b)[0] == 'paint'
+
+
+class CountingBlobGoal(BlobGoal):
+    """A BlobGoal that records the hash of every board that it scores."""
+    hashes: List[int]
+
+    def __init__(self, target_colour: Tuple[int, int, int]) -> None:
+        BlobGoal.__init__(self, target_colour)
+        self.hashes = []
+
+    def score(self, board: Block) -> int:
+        self.hashes.append(board.subtree_hash())
+        return BlobGoal.score(self, board)
+
+
+def test_smart_player_time_limit_skips_same_boards() -> None:
+    random.seed(5)
+    b = full_board(2)
+    goal = CountingBlobGoal(REAL_RED)
+    player = SmartPlayer(0, goal, 1, time_limit=10)
+    player.generate_move(b)
+    # Bounding a move scores the current board, so only the others count.
+    hashes = [h for h in goal.hashes if h != b.subtree_hash()]
+    assert len(hashes) > 2
+    assert len(set(hashes)) == len(hashes)
+
+
+class TickingClock:
+    """A stand-in for time.monotonic that moves on by <tick> seconds every
+    time that it is read, so time limits can be tested without real time."""
+    now: float
+    tick: float
+
+    def __init__(self, tick: float) -> None:
+        self.now = 0.0
+        self.tick = tick
+
+    def __call__(self) -> float:
+        self.now += self.tick
+        return self.now
+
+
+def test_smart_player_time_limit_stops_at_deadline(monkeypatch) -> None:
+    random.seed(40)
+    b = generate_board(6, 750)
+    monkeypatch.setattr(time, 'monotonic', TickingClock(0.01))
+    goal = CountingBlobGoal(REAL_RED)
+    player = SmartPlayer(0, goal, 1, time_limit=0.05)
+    move = player.generate_move(b)
+    # The clock is read once before each move is scored.
+    assert 1 <= len([h for h in goal.hashes if h != b.subtree_hash()]) <= 5
+    assert_valid_move(player, b, move)
+
+
+# TESTS FOR SEARCH PLAYER #
+def two_leaf_colours() -> Block:
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [REAL_RED, OLD_OLIVE, OLD_OLIVE, REAL_RED])
+    return b
+
+
+def test_search_player_joins_game() -> None:
+    b = two_red_blobs()
+    players = [SearchPlayer(0, BlobGoal(REAL_RED)),
+               RandomPlayer(1, PerimeterGoal(OLD_OLIVE))]
+    GameData(b, players)
+    assert players[0]._players is players
+
+
+def test_search_player_paints_perimeter() -> None:
+    b = two_leaf_colours()
+    player = SearchPlayer(0, PerimeterGoal(REAL_RED), depth=3)
+    action, direction, block = player.generate_move(b)
+    assert action == 'paint'
+    assert block.colour == OLD_OLIVE
+    assert b == two_leaf_colours()
+    assert player._table
+
+
+def test_search_player_blocks_opponent() -> None:
+    # Painting a red leaf olive both raises this player's score and keeps the
+    # opponent from joining its two red leaves into a blob of 3.
+    b = Block((0, 0), 750, None, 0, 1)
+    set_children(b, [REAL_RED, OLD_OLIVE, REAL_RED, OLD_OLIVE])
+    players = [SearchPlayer(0, PerimeterGoal(OLD_OLIVE), depth=2),
+               RandomPlayer(1, BlobGoal(REAL_RED))]
+    GameData(b, players)
+    action, direction, block = players[0].generate_move(b)
+    assert action == 'paint'
+
+
+def test_search_player_respects_budget() -> None:
+    random.seed(21)
+    b = generate_board(4, 750)
+    player = SearchPlayer(0, BlobGoal(REAL_RED), depth=4, budget=300)
+    move = player.generate_move(b)
+    assert player._nodes <= 300 + 4
+    assert_valid_move(player, b, move)
+
+
+def test_search_player_time_limit(monkeypatch) -> None:
+    random.seed(22)
+    b = generate_board(5, 750)
+    player = SearchPlayer(0, BlobGoal(REAL_RED), depth=6, budget=10 ** 9,
+                          time_limit=0.05)
+    monkeypatch.setattr(time, 'monotonic', TickingClock(0.01))
+    move = player.generate_move(b)
+    assert player._nodes <= 5
+    assert_valid_move(player, b, move)
+
+
+# TESTS FOR MCTS PLAYER #
+def test_mcts_player_paints_perimeter() -> None:
+    random.seed(30)
+    b = two_leaf_colours()
+    player = MCTSPlayer(0, PerimeterGoal(REAL_RED), iterations=300, batch=1)
+    action, direction, block = player.generate_move(b)
+    assert action == 'paint'
+    assert block.colour == OLD_OLIVE
+    assert player._root.visits == 300
+    assert b == two_leaf_colours()
+
+
+def test_mcts_player_time_limit() -> None:
+    random.seed(31)
+    b = generate_board(3, 750)
+    player = MCTSPlayer(0, BlobGoal(REAL_RED), iterations=None,
+                        time_limit=0.05)
+    move = player.generate_move(b)
+    assert player._root.visits >= 4
+    assert_valid_move(player, b, move)
+    with pytest.raises(ValueError):
+        MCTSPlayer(0, BlobGoal(REAL_RED), iterations=None)
+
+
+def test_mcts_player_reuses_tree() -> None:
+    random.seed(32)
+    b = generate_board(2, 750)
+    players = [MCTSPlayer(0, BlobGoal(REAL_RED), iterations=100),
+               SmartPlayer(1, PerimeterGoal(OLD_OLIVE), 3)]
+    data = GameData(b, players)
+    data.max_turns = 3
+    state = MainState(data)
+    assert state._do_move(players[0].generate_move(b))
+    old_root = players[0]._root
+    assert state._do_move(players[1].generate_move(b))
+    assert data.turn == 1
+    players[0].generate_move(b)
+    reachable = [child for node in old_root.children.values()
+                 for child in node.children.values()]
+    assert any(node is players[0]._root for node in reachable)
+    assert players[0]._root.visits > 100 * 4
+
+
+# TESTS FOR MAIN STATE #
+class BlockedSmartPlayer(SmartPlayer):
+    """A SmartPlayer that only starts to generate its move once <release> is
+    set."""
+    release: threading.Event
+
+    def __init__(self, player_id: int, goal: BlobGoal,
+                 difficulty: int) -> None:
+        SmartPlayer.__init__(self, player_id, goal, difficulty)
+        self.release = threading.Event()
+
+    def generate_move(self, board: Block) -> \
+            Optional[Tuple[str, Optional[int], Block]]:
+        self.release.wait()
+        return SmartPlayer.generate_move(self, board)
+
+
+def test_main_state_thinks_in_background() -> None:
+    random.seed(50)
+    b = generate_board(5, 750)
+    original = b.create_copy()
+    players = [BlockedSmartPlayer(0, BlobGoal(REAL_RED), 1)]
+    data = GameData(b, players)
+    data.max_turns = 1
+    state = MainState(data)
+    assert state.update() is state
+    # update has returned while the move is still being generated.
+    assert state._thinking is not None and not state._thinking.done()
+    assert state.update() is state
+    assert b == original
+    players[0].release.set()
+    next_state = state.update()
+    while next_state is state:
+        time.sleep(0.01)
+        next_state = state.update()
+    assert isinstance(next_state, AnimateMoveState)
+    assert data.turn == 1
+    assert state._thinking is None
+
+
+def test_main_state_waits_for_event() -> None:
+    random.seed(51)
+    b = generate_board(3, 750)
+    data = GameData(b, [RandomPlayer(0, BlobGoal(REAL_RED))])
+    data.max_turns = 1
+    state = MainState(data)
+    while not state._waiting:
+        assert state.update() is state
+        time.sleep(0.01)
+    # The player is not asked again until it has been passed an event.
+    assert state.update() is state
+    assert state._thinking is None
+    state.process_event(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1,
+                                           pos=(0, 0)))
+    next_state = state.update()
+    while next_state is state:
+        time.sleep(0.01)
+        next_state = state.update()
+    assert isinstance(next_state, AnimateMoveState)
+    next_state.close()
+    assert state._thinker._shutdown
+
+
+def test_apply_move_undo_move_restores_board() -> None:
+    random.seed(1066)
+    actions = [('rotate', 1), ('rotate', 3), ('swap', 0), ('swap', 1),
+               ('smash', None), ('paint', None), ('combine', None)]
+    for _ in range(10):
+        b = generate_board(4, 750)
+        original = b.create_copy()
+        journal = []
+        for _ in range(30):
+            location = (random.randint(0, 749), random.randint(0, 749))
+            block = _get_block(b, location, random.randint(0, 4))
+            token = block.apply_move(random.choice(actions),
+                                     random.choice(COLOUR_LIST))
+            if token is not None:
+                journal.append((block, token))
+        while journal:
+            block, token = journal.pop()
+            block.undo_move(token)
+        assert b == original
+
+
+def test_apply_move_invalid() -> None:
+    b = two_red_blobs()
+    assert b.children[1].apply_move(('rotate', 1), REAL_RED) is None
+    assert b.children[1].apply_move(('paint', None), REAL_RED) is None
+    assert b.apply_move(('smash', None), REAL_RED) is None
+    assert b == two_red_blobs()
+
+
+# TESTS FOR LINEAR BOARD #
+def test_linear_board_same_as_generate_board() -> None:
+    for seed in range(5):
+        random.seed(seed)
+        b = generate_board(4, 750)
+        random.seed(seed)
+        assert generate_linear_board(4, 750).to_block() == b
+
+
+def test_linear_board_from_block() -> None:
+    b = two_red_blobs()
+    board = from_block(b)
+    assert board.to_block() == b
+    assert len(board.colours) == 9
+    with pytest.raises(ValueError):
+        from_block(Block((0, 0), 750, BLACK, 0, 0))
+
+
+def test_linear_board_to_raster() -> None:
+    pytest.importorskip('numpy')
+    random.seed(13)
+    for depth in range(5):
+        board = generate_linear_board(depth, 750)
+        b = board.to_block()
+        assert (board.to_raster() == _flatten_indices(b)).all()
+        for goal in [BlobGoal(REAL_RED), PerimeterGoal(OLD_OLIVE)]:
+            assert goal.score_raster(board.to_raster()) == goal.score(b)
+
+
+def test_linear_board_moves_match_block() -> None:
+    random.seed(8)
+    b = generate_board(3, 750)
+    board = from_block(b)
+    for location, level in [((0, 0), 0), ((700, 10), 1), ((200, 600), 2)]:
+        block = _get_block(b, location, level)
+        node = board.node_at(location, level)
+        assert block.rotate(1) == board.rotate(node, 1)
+        assert block.swap(0) == board.swap(node, 0)
+        assert block.swap(1) == board.swap(node, 1)
+        assert block.rotate(3) == board.rotate(node, 3)
+        assert board.to_block() == b
+
+
+def test_linear_board_combine_reuses_nodes() -> None:
+    b = two_red_blobs()
+    board = from_block(b)
+    node = board.node_at((700, 10), 1)
+    assert board.combine(node)
+    assert board.colours[node] == COLOUR_LIST.index(OLD_OLIVE)
+    assert board.children[node] == -1
+    random.seed(1)
+    while not board.smash(node) or board.children[node] == -1:
+        board.combine(node)
+    assert len(board.colours) == 9
+
+
+def test_linear_board_copy_is_independent() -> None:
+    board = from_block(two_red_blobs())
+    copy = board.copy()
+    assert copy.paint(copy.node_at((0, 0), 2), 0) is False
+    assert copy.swap(0, 0)
+    assert copy.to_block() != board.to_block()
+    assert board.to_block() == two_red_blobs()
+
+
+if __name__ == '__main__':
+    pytest.main(['test_cases3.py'])